@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+Performance benchmarks.
+"""
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module measures how long it takes to import the CLI (or any other module)
+in a fresh interpreter with the network disabled, and reports the slowest imports
+(as collected by 'python -X importtime').
+
+Use like so:
+    python -m benchmarks.importtime --module=ycap --runs=5 --limit=1.0
+    python -m benchmarks.importtime --module=ycap --top=15
+"""
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# any attempt to connect raises immediately, as if offline
+NO_NETWORK = """
+import socket
+def _no_network(*args, **kwargs):
+    raise OSError('network is disabled')
+socket.socket.connect = _no_network
+socket.create_connection = _no_network
+socket.getaddrinfo = _no_network
+"""
+
+IMPORT_TIMER = """
+import time
+_t = time.perf_counter()
+import {module}
+print(time.perf_counter() - _t)
+"""
+
+def time_import(module='ycap', network=False):
+    """
+    Imports the module in a new interpreter.
+    RETURNS:
+        tuple (import time [sec.], total process time [sec.])
+    """
+    code = ('' if network else NO_NETWORK) + IMPORT_TIMER.format(module=module)
+    t = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, check=True, 
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return float(out.strip().splitlines()[-1]), time.perf_counter() - t
+
+def bench_import(module='ycap', runs=5, network=False):
+    """
+    Runs time_import() several times.
+    RETURNS:
+        dict with median / max import and process times [sec.]
+    """
+    results = [time_import(module, network) for _ in range(runs)]
+    imports = [r[0] for r in results]
+    totals = [r[1] for r in results]
+    return {'module': module, 'runs': runs, 
+            'import_median': statistics.median(imports), 'import_max': max(imports),
+            'process_median': statistics.median(totals), 'process_max': max(totals)}
+
+def importtime_report(module='ycap', network=False):
+    """
+    Imports the module in a new interpreter with '-X importtime'.
+    RETURNS:
+        list of (imported module, self time [sec.], cumulative time [sec.]) sorted by cumulative time
+    """
+    code = ('' if network else NO_NETWORK) + 'import {}'.format(module)
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT_DIR, check=True, 
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True).stderr
+    report = []
+    for line in err.splitlines():
+        if not line.startswith('import time:'): continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            report.append((fields[2].strip(), int(fields[0]) / 1e6, int(fields[1]) / 1e6))
+        except (IndexError, ValueError):
+            # header line
+            continue
+    return sorted(report, key=lambda x: -x[2])
+
+def format_report(report, top=15):
+    lines = ['{:<48} {:>10} {:>12}'.format('MODULE', 'SELF, ms', 'CUMUL., ms')]
+    for name, self_time, cumulative in report[:top]:
+        lines.append('{:<48} {:>10.1f} {:>12.1f}'.format(name, self_time * 1000.0, cumulative * 1000.0))
+    return '\n'.join(lines)
+
+def main(module='ycap', runs=5, limit=1.0, network=False, top=0):
+    if top: print(format_report(importtime_report(module, network), top))
+    res = bench_import(module, runs, network)
+    print('import {module}: median = {import_median:.3f}s, max = {import_max:.3f}s; '
+          'process: median = {process_median:.3f}s, max = {process_max:.3f}s'.format(**res))
+    if res['process_max'] > limit:
+        print('FAILED: slower than {:.3f}s'.format(limit))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    import fire
+    fire.Fire(main)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a local stand-in for the Yandex XML captcha service:
+    /search/xml     returns an XML response with a <captcha-img-url> pointing to this server
+    /captcha/<n>    returns a unique GIF image
+"""
+
+import io
+import time
+import threading
+import multiprocessing as mp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+XML_TEMPLATE = '<?xml version="1.0" encoding="utf-8"?><response><captcha-img-url>{}</captcha-img-url></response>'
+
+def make_gif(n, size=(200, 60)):
+    """
+    Returns the bytes of a GIF image unique for the number n.
+    """
+    img = Image.new('L', size, color=255)
+    ImageDraw.Draw(img).text((10, 20), '{:06d}'.format(n % 1000000), fill=0)
+    # encode all bits of n as pixels, so that images never repeat
+    for i in range(64):
+        if (n >> i) & 1: img.putpixel((i % size[0], size[1] - 1 - i // size[0]), 0)
+    buf = io.BytesIO()
+    img.save(buf, 'GIF')
+    return buf.getvalue()
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # send small responses at once on keep-alive connections (otherwise Nagle + delayed ACK add ~40 ms per request)
+    disable_nagle_algorithm = True
+
+    def _send(self, code, ctype, body):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server.owner
+        if server.latency: time.sleep(server.latency)
+        if self.path.startswith('/search/xml'):
+            with server.lock:
+                server.counter += 1
+                n = server.counter
+            self._send(200, 'text/xml; charset=utf-8', XML_TEMPLATE.format('{}/captcha/{}'.format(server.url, n)).encode('utf-8'))
+        elif self.path.startswith('/captcha/'):
+            try:
+                n = int(self.path.rsplit('/', 1)[-1])
+            except ValueError:
+                self._send(404, 'text/plain', b'Not found')
+                return
+            self._send(200, 'image/gif', make_gif(n))
+        else:
+            self._send(404, 'text/plain', b'Not found')
+
+    def log_message(self, format, *args):
+        pass
+
+## ******************************************************************************** ##
+
+class MockYandexServer:
+    """
+    Local HTTP server emulating the Yandex XML captcha service, running in a background thread
+    (see MockServerProcess to run it in a separate process).
+    Use like so:
+        with MockYandexServer(latency=0.01) as server:
+            download_sample_captchas('user', 'key', ncap=100, xml_url=server.xml_url)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.url = 'http://{}:{}'.format(*self.httpd.server_address[:2])
+        self.xml_url = self.url + '/search/xml?query={query}&user={user}&key={apikey}&domain={domain}'
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread: self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def _serve(host, port, latency, conn):
+    with MockYandexServer(host, port, latency) as server:
+        conn.send(server.url)
+        # serve until the parent closes its end of the pipe
+        try:
+            conn.recv()
+        except EOFError:
+            pass
+
+class MockServerProcess:
+    """
+    MockYandexServer running in its own process, so that serving requests doesn't compete
+    with the measured client code for the GIL (use it for throughput benchmarks).
+    Use like so:
+        with MockServerProcess(latency=0.005) as server:
+            download_sample_captchas('user', 'key', ncap=100, xml_url=server.xml_url)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.url = self.xml_url = None
+        self._conn = None
+        self._proc = None
+
+    def start(self):
+        ctx = mp.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._proc = ctx.Process(target=_serve, args=(self.host, self.port, self.latency, child_conn), daemon=True)
+        self._proc.start()
+        child_conn.close()
+        self.url = self._conn.recv()
+        self.xml_url = self.url + '/search/xml?query={query}&user={user}&key={apikey}&domain={domain}'
+        return self
+
+    def stop(self):
+        self._conn.close()
+        self._proc.join(timeout=5)
+        if self._proc.is_alive(): self._proc.terminate()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
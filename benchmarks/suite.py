@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides benchmarks of the synthesis, download and export hot paths.
+Each benchmark reports items/sec, latency percentiles and peak RSS for fixed seeds;
+results can be saved to JSON and compared against a saved baseline.
+
+Use like so:
+    python -m benchmarks.suite --names=synth,bezier --n=200 --output=bench.json
+    python -m benchmarks.suite --baseline=bench.json
+"""
+
+import os
+import sys
+import json
+import hashlib
+import time
+import random
+import shutil
+import tempfile
+import multiprocessing as mp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not ROOT_DIR in sys.path: sys.path.insert(0, ROOT_DIR)
+
+from imgprocess import capprocess
+from imgprocess.npsynth import synth_batch_np
+from utils.utils import convert_img, set_ip, iter_files
+from utils.xls import ExcelImageWriter
+from utils import download
+from utils.download import fetch_captcha
+from utils.pipeline import download_pipeline
+from benchmarks.mockserver import MockServerProcess, make_gif
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PERCENTILES = (50, 90, 99)
+REGRESSION_METRIC = 'per_sec'
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (None if not available on this platform).
+    It never decreases, so run_benchmarks() runs each benchmark in a fresh process.
+    """
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return rss / 1024**2 if sys.platform == 'darwin' else rss / 1024
+
+def measure(calls, items=None):
+    """
+    Runs the zero-argument callables one after another, timing each.
+    PARAMS:
+        - calls [iterable]: callables to time
+        - items [int]: number of processed items (default = number of calls)
+    RETURNS:
+        dict: items, total time, items/sec, latency percentiles [ms], peak RSS [MB]
+    """
+    latencies = []
+    for call in calls:
+        t = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, sum(latencies), items)
+
+def summarize(latencies, total, items=None):
+    """
+    PARAMS:
+        - latencies [list]: per-item latencies [sec]
+        - total [float]: total run time [sec] (can be less than the sum of latencies if items overlap)
+        - items [int]: number of processed items (default = number of latencies)
+    RETURNS:
+        dict: items, total time, items/sec, latency percentiles [ms], peak RSS [MB]
+    """
+    items = items or len(latencies)
+    res = {'items': items, 'total_sec': total, 'per_sec': items / total if total else float('inf')}
+    for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES) if len(latencies) else [float('nan')] * len(PERCENTILES)):
+        res['p{}_ms'.format(p)] = v * 1000.0
+    res['peak_rss_mb'] = peak_rss_mb()
+    return res
+
+## ******************************************************************************** ##
+
+def bench_synth(n, seed, workdir):
+    # full synth_captcha() including PNG save
+    capprocess.SAVE_FOLDER = os.path.join(workdir, 'synth')
+    os.makedirs(capprocess.SAVE_FOLDER, exist_ok=True)
+    capprocess.warmup_resources()
+    random.seed(seed)
+    return measure(capprocess.synth_captcha for _ in range(n))
+
+def bench_npsynth(n, seed, workdir, batch_size=256):
+    # batched NumPy engine (in-memory arrays, no saving)
+    capprocess.warmup_resources()
+    rng = np.random.default_rng(seed)
+    synth_batch_np(batch_size, rng)
+    sizes = [batch_size] * (n // batch_size) + ([n % batch_size] if n % batch_size else [])
+    return measure((lambda size=size: synth_batch_np(size, rng) for size in sizes), n)
+
+def bench_bezier(n, seed, workdir):
+    rng = np.random.RandomState(seed)
+    curves = [rng.randint(0, capprocess.YC_WIDTH, size=(rng.randint(*capprocess.YC_SYNTH['curve_complexity']) + 1, 2))
+              for _ in range(n)]
+    return measure(lambda xys=xys: capprocess.bezier_points(xys, capprocess.YC_WIDTH + 1) for xys in curves)
+
+def bench_transform(n, seed, workdir):
+    random.seed(seed)
+    _, img = capprocess.render_captcha()
+    digit = img.crop((0, 0, 40, 60))
+    params = [(random.randint(*capprocess.YC_SYNTH['skew_angles']),
+               (20 + random.randint(*capprocess.YC_SYNTH['skew_center']), 30 + random.randint(*capprocess.YC_SYNTH['skew_center'])),
+               random.choice(capprocess.YC_SYNTH['transform_resamples'])) for _ in range(n)]
+    return measure(lambda p=p: capprocess.ScaleRotateTranslate(digit, p[0], new_center=p[1], resample=p[2]) for p in params)
+
+def _make_gifs(n, directory):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(n):
+        with open(os.path.join(directory, '{:06d}.gif'.format(i)), 'wb') as f:
+            f.write(make_gif(i))
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory))
+
+def bench_convert(n, seed, workdir):
+    files = _make_gifs(n, os.path.join(workdir, 'convert'))
+    return measure(lambda f=f: convert_img(f, verbose=False) for f in files)
+
+def bench_excel(n, seed, workdir):
+    imgdir = os.path.join(workdir, 'excel')
+    for f in _make_gifs(n, imgdir): convert_img(f, dest_format='png', verbose=False)
+    # latency = writing a row; the images are embedded when the workbook is closed, which counts to the total only
+    files = list(iter_files(imgdir, False, ('png',)))
+    writer = ExcelImageWriter(os.path.join(workdir, 'bench.xlsx'))
+    res = measure(lambda f=f: writer.write(f) for f in files)
+    t = time.perf_counter()
+    writer.close()
+    close = time.perf_counter() - t
+    res.update(total_sec=res['total_sec'] + close, per_sec=res['items'] / (res['total_sec'] + close), close_ms=close * 1000.0)
+    return res
+
+def bench_download(n, seed, workdir, concurrency=8, latency=0.005):
+    # latency = from the first request of a captcha to its file being saved
+    set_ip('127.0.0.1')
+    started = {}
+    latencies = []
+
+    def fetch(*args, **kwargs):
+        t = time.perf_counter()
+        res = fetch_captcha(*args, **kwargs)
+        if res: started[hashlib.md5(res[0].encode()).hexdigest()] = t
+        return res
+
+    def saved(i, fpath):
+        latencies.append(time.perf_counter() - started.pop(os.path.splitext(os.path.basename(fpath))[0]))
+        return fpath
+
+    # this runs in its own process (see run_benchmarks()), so the downloader can be instrumented in place
+    download.fetch_captcha = fetch
+    with MockServerProcess(latency=latency) as server:
+        t = time.perf_counter()
+        download.download_sample_captchas('user', 'key', ncap=n, directory=os.path.join(workdir, 'download'), cback=saved,
+                                          concurrency=concurrency, xml_url=server.xml_url)
+        return summarize(latencies, time.perf_counter() - t, n)
+
+def bench_pipeline(n, seed, workdir, fetchers=8, converters=2, latency=0.005):
+    # download + convert to JPG + Excel export, as concurrent stages
+    # latency = from entering the pipeline to being exported
+    set_ip('127.0.0.1')
+    latencies = []
+    with MockServerProcess(latency=latency) as server:
+        t = time.perf_counter()
+        download_pipeline('user', 'key', ncap=n, directory=os.path.join(workdir, 'pipeline'), fetchers=fetchers,
+                          converters=converters, xml_url=server.xml_url, latencies=latencies)
+        return summarize(latencies, time.perf_counter() - t, n)
+
+BENCHMARKS = {'synth': bench_synth, 'npsynth': bench_npsynth, 'bezier': bench_bezier, 'transform': bench_transform,
+              'convert': bench_convert, 'excel': bench_excel, 'download': bench_download, 'pipeline': bench_pipeline}
+
+## ******************************************************************************** ##
+
+def _run_benchmark(name, n, seed, workdir):
+    return BENCHMARKS[name](n, seed, workdir)
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Compares benchmark results with a baseline.
+    RETURNS:
+        list of (benchmark name, baseline items/sec, current items/sec) for benchmarks
+        slower than the baseline by more than tolerance (fraction)
+    """
+    regressions = []
+    for name, res in results.items():
+        if not name in baseline: continue
+        base = baseline[name][REGRESSION_METRIC]
+        if res[REGRESSION_METRIC] < base * (1.0 - tolerance):
+            regressions.append((name, base, res[REGRESSION_METRIC]))
+    return regressions
+
+def run_benchmarks(names=None, n=200, seed=0, output=None, baseline=None, tolerance=0.1, verbose=True):
+    """
+    Runs the benchmarks.
+    PARAMS:
+        - names [str or list]: benchmark names (comma-separated), see BENCHMARKS; None = all
+        - n [int]: number of items per benchmark
+        - seed [int]: random seed
+        - output [str]: OPTIONAL: JSON file to save the results to
+        - baseline [str]: OPTIONAL: JSON file with saved results to compare with
+        - tolerance [float]: allowed slowdown against the baseline (fraction)
+    RETURNS:
+        tuple (results dict, list of regressions - see compare_results())
+    """
+    if names is None: names = list(BENCHMARKS)
+    elif isinstance(names, str): names = [s.strip() for s in names.split(',') if s.strip()]
+    unknown = [name for name in names if not name in BENCHMARKS]
+    if unknown: raise Exception('Unknown benchmarks: {}'.format(', '.join(unknown)))
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='ycap_bench_')
+    try:
+        for name in names:
+            # a fresh process per benchmark: its own peak RSS and no state left over from the previous ones
+            with ProcessPoolExecutor(1, mp_context=mp.get_context('spawn')) as executor:
+                results[name] = executor.submit(_run_benchmark, name, n, seed, workdir).result()
+            if verbose: print(format_result(name, results[name]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    regressions = []
+    if baseline:
+        with open(baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), tolerance)
+    return results, regressions
+
+def format_result(name, res):
+    return '{:<10} {:>10.1f}/s   p50 = {:.2f} ms   p90 = {:.2f} ms   p99 = {:.2f} ms   peak RSS = {} MB'.format(
+        name, res['per_sec'], res['p50_ms'], res['p90_ms'], res['p99_ms'],
+        '?' if res['peak_rss_mb'] is None else '{:.1f}'.format(res['peak_rss_mb']))
+
+def main(names=None, n=200, seed=0, output=None, baseline=None, tolerance=0.1):
+    _, regressions = run_benchmarks(names, n, seed, output, baseline, tolerance)
+    for name, base, cur in regressions:
+        print('REGRESSION: {}: {:.1f}/s (baseline {:.1f}/s)'.format(name, cur, base))
+    if regressions: sys.exit(1)
+
+if __name__ == '__main__':
+    import fire
+    fire.Fire(main)
@@ -5,11 +5,21 @@
 This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
 """
 
+import os
+import sys
 import numpy as np
 import random
+import multiprocessing as mp
 import uuid
+from functools import partial
 from PIL import Image, ImageFont, ImageDraw
-from dask.distributed import Client as DaskClient
+# allow running this module as a script from its own directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not ROOT_DIR in sys.path: sys.path.insert(0, ROOT_DIR)
+from utils.executors import get_executor, auto_chunksize
+from utils.shards import ShardWriter
+from utils.profiling import stage, profiled_call, StageProfiler
+from utils.jobs import report_progress, current_job
 
 YC_CHARS = '0123456789'
 YC_LENGTH = 6
@@ -24,7 +34,141 @@ YC_SYNTH = {'digit_start_offset': (3, 10), 'transform_times': 3, 'skew_angles':
             'curve_sections': (1, 4), 'curve_section_offset': 20, 'logo_resize': 0.7,
             'digit_fonts': ['fonts/antquab.ttf', 'fonts/ariblk.ttf', 'fonts/arlrdbd.ttf', 'fonts/impact.ttf'],
             'digit_font_sizes': list(range(48, 55, 1))}
-SAVE_FOLDER = '../imgset/synth'
+SAVE_FOLDER = '../imgset/synth'    # relative to this module's directory (see resource_path())
+LOGO_FILE = '../assets/yandex-for-white-background_{}.png'
+LOGO_COUNTRIES = ('en', 'ru')
+
+JOB_CHUNKSIZE = 8               # max captchas per task in background jobs (keeps progress and cancellation responsive)
+GLYPH_ATLAS_FILE = None         # OPTIONAL: .npz file to load the pre-rendered glyph atlas from (see save_glyph_atlas())
+# named difficulty levels for synth_config() (1.0 = YC_SYNTH as is)
+YC_DIFFICULTY = {'easy': 0.5, 'normal': 1.0, 'hard': 1.5}
+
+def synth_config(difficulty=1.0, **overrides):
+    """
+    Makes a synthesis config: a copy of YC_SYNTH with the distortions scaled by the difficulty,
+    which can be passed to render_captcha(), synth_batch() etc. to run difficulty curricula
+    or parameter sweeps without editing YC_SYNTH.
+    PARAMS:
+        - difficulty [float or str]: distortion scale (> 0) or one of YC_DIFFICULTY names;
+          scales the skew angles, the number and complexity of curves and the digit overlap
+        - overrides: YC_SYNTH keys to set explicitly (applied after scaling)
+    RETURNS:
+        config dict
+    """
+    if isinstance(difficulty, str): difficulty = YC_DIFFICULTY[difficulty]
+    if difficulty <= 0: raise Exception('Difficulty must be positive')
+    config = dict(YC_SYNTH)
+    config['skew_angles'] = tuple(int(round(x * difficulty)) for x in YC_SYNTH['skew_angles'])
+    config['curve_number'] = int(round(YC_SYNTH['curve_number'] * difficulty))
+    cc0, cc1 = YC_SYNTH['curve_complexity']
+    config['curve_complexity'] = (cc0, max(cc0 + 1, int(round(cc1 * difficulty))))
+    # the overlap is digit width / digit_hzoffset, so harder = smaller divisors
+    config['digit_hzoffset'] = tuple(x / difficulty for x in YC_SYNTH['digit_hzoffset'])
+    config.update(overrides)
+    return config
+
+# per-process caches of loaded fonts, (pre-resized) logos and outlined digit glyphs
+_FONT_CACHE = {}
+_LOGO_CACHE = {}
+_GLYPH_CACHE = {}
+
+def resource_path(path):
+    """
+    Resolves a resource path (font, logo, SAVE_FOLDER) relative to this module's directory,
+    so that it doesn't depend on the current working directory.
+    """
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), path))
+
+def get_font(font_file, font_size):
+    """
+    Returns the TrueType font for the given (font file, size) pair, loading it only once per process.
+    """
+    key = (font_file, font_size)
+    font = _FONT_CACHE.get(key, None)
+    if font is None:
+        font = ImageFont.truetype(resource_path(font_file), font_size)
+        _FONT_CACHE[key] = font
+    return font
+
+def get_logo(logo_country='en'):
+    """
+    Returns the Yandex logo image for the given country, resized by YC_SYNTH['logo_resize'].
+    The logo is loaded and resized only once per process.
+    """
+    logo_img = _LOGO_CACHE.get(logo_country, None)
+    if logo_img is None:
+        with Image.open(resource_path(LOGO_FILE.format(logo_country))) as f:
+            logo_img = f.resize( tuple(int(x * YC_SYNTH['logo_resize']) for x in f.size) )
+        _LOGO_CACHE[logo_country] = logo_img
+    return logo_img
+
+def get_glyph(font_file, font_size, digit):
+    """
+    Returns the outlined glyph of a digit for the given font and size, rendered only once per process.
+    RETURNS:
+        tuple (transparent RGBA glyph image [do not modify], text size of the digit)
+    """
+    key = (font_file, font_size, digit)
+    glyph = _GLYPH_CACHE.get(key, None)
+    if glyph is None:
+        font = get_font(font_file, font_size)
+        # calculate the text size in pixels for the selected digit and font
+        digit_sz = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textsize(digit, font=font)
+        # new transparent (alpha) image layer
+        txt = Image.new('RGBA', tuple(x + 5 for x in digit_sz), color=YC_BACKCOLOR_TR)
+        outline_text(ImageDraw.Draw(txt), (0, 0), digit, font, YC_TEXTCOLOR, YC_BACKCOLOR_TR)
+        glyph = _GLYPH_CACHE[key] = (txt, digit_sz)
+    return glyph
+
+def build_glyph_atlas():
+    """
+    Renders the glyphs of all digits in all fonts & sizes from YC_SYNTH.
+    RETURNS:
+        number of glyphs in the atlas
+    """
+    for font_file in YC_SYNTH['digit_fonts']:
+        for font_size in YC_SYNTH['digit_font_sizes']:
+            for digit in YC_CHARS:
+                get_glyph(font_file, font_size, digit)
+    return len(_GLYPH_CACHE)
+
+def save_glyph_atlas(filename):
+    """
+    Builds the glyph atlas and saves it to a compressed .npz file.
+    """
+    build_glyph_atlas()
+    keys = list(_GLYPH_CACHE)
+    arrays = {'glyph{}'.format(i): np.asarray(_GLYPH_CACHE[key][0]) for i, key in enumerate(keys)}
+    np.savez_compressed(filename, keys=np.array(['{}|{}|{}'.format(*key) for key in keys]), 
+                        sizes=np.array([_GLYPH_CACHE[key][1] for key in keys]), **arrays)
+
+def load_glyph_atlas(filename):
+    """
+    Loads glyphs saved with save_glyph_atlas() into the glyph cache.
+    RETURNS:
+        number of glyphs in the atlas
+    """
+    with np.load(filename) as atlas:
+        for i, (key, size) in enumerate(zip(atlas['keys'], atlas['sizes'])):
+            font_file, font_size, digit = str(key).split('|')
+            _GLYPH_CACHE[(font_file, int(font_size), digit)] = (Image.fromarray(atlas['glyph{}'.format(i)], 'RGBA'), tuple(int(x) for x in size))
+    return len(_GLYPH_CACHE)
+
+def warmup_resources(logo_countries=LOGO_COUNTRIES, glyphs=True):
+    """
+    Preloads all fonts, logos and (if glyphs == True) digit glyphs used in synth_captcha() 
+    into the process caches. Call it once when a worker process starts.
+    """
+    for font_file in YC_SYNTH['digit_fonts']:
+        for font_size in YC_SYNTH['digit_font_sizes']:
+            get_font(font_file, font_size)
+    for logo_country in logo_countries:
+        get_logo(logo_country)
+    if glyphs:
+        if GLYPH_ATLAS_FILE and os.path.isfile(GLYPH_ATLAS_FILE): 
+            load_glyph_atlas(GLYPH_ATLAS_FILE)
+        build_glyph_atlas()
+    return len(_FONT_CACHE), len(_LOGO_CACHE), len(_GLYPH_CACHE)
 
 def pascal_row(n, memo={}):
     # This returns the nth row of Pascal's Triangle
@@ -45,26 +189,51 @@ def pascal_row(n, memo={}):
     memo[n] = result
     return result
 
+def bernstein_basis(degree, ts):
+    # This returns the (len(ts) x degree+1) matrix of Bernstein basis polynomials
+    # http://en.wikipedia.org/wiki/B%C3%A9zier_curve#Generalization
+    ts = np.asarray(ts, dtype=np.float64)[:, None]
+    k = np.arange(degree + 1)
+    return np.asarray(pascal_row(degree), dtype=np.float64) * ts**k * (1.0 - ts)**(degree - k)
+
+def bernstein_matrix(degree, nsamples, memo={}):
+    # This returns the Bernstein basis matrix for nsamples uniform t-values in [0, 1]
+    key = (degree, nsamples)
+    if key in memo: return memo[key]
+    result = bernstein_basis(degree, np.linspace(0.0, 1.0, nsamples))
+    result.setflags(write=False)
+    memo[key] = result
+    return result
+
+def bezier_points(xys, nsamples):
+    """
+    Evaluates Bezier curve(s) at nsamples uniform t-values in one matrix multiply.
+    PARAMS:
+        - xys [array-like]: control points, shape (n, 2) for one curve
+                            or (k, n, 2) for k curves of the same degree
+        - nsamples [int]: number of sampled points per curve
+    RETURNS:
+        ndarray of shape (nsamples, 2) or (k, nsamples, 2)
+    """
+    xys = np.asarray(xys, dtype=np.float64)
+    return bernstein_matrix(xys.shape[-2] - 1, nsamples) @ xys
+
 def make_bezier(xys):
     # xys should be a sequence of 2-tuples (Bezier control points)
     n = len(xys)
-    combinations = pascal_row(n-1)
     def bezier(ts):
-        # This uses the generalized formula for bezier curves
-        # http://en.wikipedia.org/wiki/B%C3%A9zier_curve#Generalization
-        result = []
-        for t in ts:
-            tpowers = (t**i for i in range(n))
-            upowers = reversed([(1-t)**i for i in range(n)])
-            coefs = [c*a*b for c, a, b in zip(combinations, tpowers, upowers)]
-            result.append(
-                tuple(sum([coef*p for coef, p in zip(coefs, ps)]) for ps in zip(*xys)))
-        return result
+        return [tuple(p) for p in (bernstein_basis(n - 1, ts) @ np.asarray(xys, dtype=np.float64)).tolist()]
     return bezier
 
-def ScaleRotateTranslate(image, angle, center=None, new_center=None, scale=None, method=Image.AFFINE, resample=Image.BICUBIC):
+def srt_matrix(size, angle, center=None, new_center=None, scale=None):
+    """
+    Returns the 3x3 matrix of ScaleRotateTranslate() mapping output to input pixel coordinates.
+    Without a center, this is a rotation around the image center (same as Image.rotate()).
+    Matrices of successive transforms are composed as M1 @ M2 @ ... @ Mn.
+    """
     if center is None:
-        return image.rotate(angle)
+        center = new_center = (size[0] / 2.0, size[1] / 2.0)
+        scale = None
     angle = -angle/180.0 * np.pi
     nx,ny = x,y = center
     sx = sy = 1.0
@@ -80,7 +249,23 @@ def ScaleRotateTranslate(image, angle, center=None, new_center=None, scale=None,
     d = -sine/sy
     e = cosine/sy
     f = y-nx*d-ny*e
-    return image.transform(image.size, method, (a,b,c,d,e,f), resample) # NEAREST gives better results for captcha than BICUBIC
+    return np.array([[a, b, c], [d, e, f], [0.0, 0.0, 1.0]])
+
+def transform_image(image, matrix, method=Image.AFFINE, resample=Image.BICUBIC):
+    """
+    Resamples the image once with a 3x3 (output -> input) matrix: 
+    affine (top two rows) or perspective (homography normalized to matrix[2, 2] = 1).
+    """
+    if method == Image.PERSPECTIVE:
+        data = tuple((matrix / matrix[2, 2]).ravel()[:8])
+    else:
+        data = tuple(matrix[:2].ravel())
+    return image.transform(image.size, method, data, resample)
+
+def ScaleRotateTranslate(image, angle, center=None, new_center=None, scale=None, method=Image.AFFINE, resample=Image.BICUBIC):
+    if center is None:
+        return image.rotate(angle)
+    return transform_image(image, srt_matrix(image.size, angle, center, new_center, scale), method, resample) # NEAREST gives better results for captcha than BICUBIC
 
 def outline_text(dr, pos, text, fnt, stroke, fill):
     dr.text((pos[0]-1, pos[1]), text, font=fnt, fill=stroke)
@@ -89,7 +274,7 @@ def outline_text(dr, pos, text, fnt, stroke, fill):
     dr.text((pos[0], pos[1]+1), text, font=fnt, fill=stroke)
     dr.text(tuple(pos), text, font=fnt, fill=fill)
 
-def synth_captcha(logo_country='en'):
+def render_captcha(logo_country='en', rng=None, config=None):
     """
     Yandex Captcha generation steps:
         1. Generate a random array of 6 digits [0...9], e.g. [8, 3, 2, 5, 6, 8]
@@ -117,12 +302,20 @@ def synth_captcha(logo_country='en'):
             - size = uniform (calculate)
             - alpha = 100% transparent white color
         8. Add noise to whole image (pixelize) - ??
+    PARAMS:
+        - logo_country [str]: 'en' or 'ru' logo
+        - rng [random.Random]: OPTIONAL: random generator (default = global 'random' module), see sample_rng()
+        - config [dict]: OPTIONAL: synthesis parameters (default = YC_SYNTH), see synth_config()
+    RETURNS:
+        tuple (digits [str], image [PIL RGBA Image])
     """
+    if rng is None: rng = random
+    if config is None: config = YC_SYNTH
     
     # generate empty image
     img = Image.new('RGBA', (YC_WIDTH, YC_HEIGHT), color=YC_BACKCOLOR)
     
-    digit_offset = [random.randint(1, YC_SYNTH['digit_start_offset'][0]), random.randint(1, YC_SYNTH['digit_start_offset'][1])]
+    digit_offset = [rng.randint(1, config['digit_start_offset'][0]), rng.randint(1, config['digit_start_offset'][1])]
     digit_sz = [0, 0]
     digit_offset = [1, 0]
     
@@ -130,88 +323,209 @@ def synth_captcha(logo_country='en'):
     digits = ''
     for i in range(YC_LENGTH):
         # pick random digit
-        digit = random.choice(YC_CHARS)    
+        digit = rng.choice(YC_CHARS)    
         digits += str(digit)
         # pick random font and size (from corresponding lists)
-        font = ImageFont.truetype(random.choice(YC_SYNTH['digit_fonts']), random.choice(YC_SYNTH['digit_font_sizes']))
-        # calculate the text size in pixels for the selected digit and font
-        draw = ImageDraw.Draw(img)
-        digit_sz = draw.textsize(digit, font=font)
-        # new transparent (alpha) image layer
-        txt = Image.new('RGBA', tuple(x + 5 for x in digit_sz), color=YC_BACKCOLOR_TR)
-        # canvas
-        draw = ImageDraw.Draw(txt)
-        # draw digit     
-        outline_text(draw, (0, 0), digit, font, YC_TEXTCOLOR, YC_BACKCOLOR_TR)
-        # skew several times
-        for _ in range(YC_SYNTH['transform_times']):
-            txt = ScaleRotateTranslate(txt, random.randint(*YC_SYNTH['skew_angles']), 
-                                       new_center=(txt.width / 2 + random.randint(*YC_SYNTH['skew_center']), 
-                                                   txt.height / 2 + random.randint(*YC_SYNTH['skew_center'])), 
-                                       method=random.choice(YC_SYNTH['transform_methods']),
-                                       resample=random.choice(YC_SYNTH['transform_resamples']))       
+        font_file = rng.choice(config['digit_fonts'])
+        font_size = rng.choice(config['digit_font_sizes'])
+        # outlined digit (rendered once per font & size, see get_glyph())
+        with stage('glyph'):
+            txt, digit_sz = get_glyph(font_file, font_size, digit)
+        # skew several times: compose the transforms and resample once
+        with stage('transform'):
+            matrix = np.eye(3)
+            for _ in range(config['transform_times']):
+                angle = rng.randint(*config['skew_angles'])
+                # ScaleRotateTranslate() without a center rotates around the image center (AFFINE, NEAREST),
+                # so the new center, method and resample are only drawn to keep the random sequence
+                new_center = (txt.width / 2 + rng.randint(*config['skew_center']), 
+                              txt.height / 2 + rng.randint(*config['skew_center']))
+                method = rng.choice(config['transform_methods'])
+                resample = rng.choice(config['transform_resamples'])
+                matrix = matrix @ srt_matrix(txt.size, angle)
+            txt = transform_image(txt, matrix, Image.AFFINE, Image.NEAREST)
                 
         # make random horizontal offset (in most captchas, the digits overlap)  
-        digit_offset[0] += digit_sz[0] + random.randint(
-                -digit_sz[0] // YC_SYNTH['digit_hzoffset'][0], 
-                -digit_sz[0] // YC_SYNTH['digit_hzoffset'][1])
+        digit_offset[0] += digit_sz[0] + rng.randint(
+                -digit_sz[0] // config['digit_hzoffset'][0], 
+                -digit_sz[0] // config['digit_hzoffset'][1])
         # calculate the text size in pixels for the selected digit and font
         #digit_sz = draw.textsize(digit, font=font)
         # make random vertical offset (digit must not get clipped by image boundaries)
-        digit_offset[1] = random.randint(1, max(2, YC_HEIGHT - digit_sz[1] - 15))
+        digit_offset[1] = rng.randint(1, max(2, YC_HEIGHT - digit_sz[1] - 15))
         # paste digit at random position to background img
-        img.paste(txt, tuple(digit_offset), txt)        
+        with stage('paste'):
+            img.paste(txt, tuple(digit_offset), txt)        
           
     # make 2 curves across the combined image
-    for _ in range(YC_SYNTH['curve_number']):
-        curveimg = Image.new('RGBA', img.size, color=YC_BACKCOLOR_TR)
-        draw = ImageDraw.Draw(curveimg)
-        ts = [t/img.width for t in range(img.width + 1)]
-        xys = [(random.randint(YC_SYNTH['curve_start_offset'][0], img.width * YC_SYNTH['curve_start_offset'][1]), 
-                random.randint(0, img.height))]
-        j = 0
-        for i in range(random.randrange(*YC_SYNTH['curve_complexity'])):
-            j += 1
-            xys.append((random.randint(xys[j-1][0] + 2, xys[j-1][0] + YC_SYNTH['curve_section_offset']), 
-                        random.randint(0, img.height)))
-        points = make_bezier(xys)(ts)
-        for k in range(random.randrange(*YC_SYNTH['curve_sections'])):
-            xys = [xys[-1]]
+    for _ in range(config['curve_number']):
+        with stage('curves'):
+            curveimg = Image.new('RGBA', img.size, color=YC_BACKCOLOR_TR)
+            draw = ImageDraw.Draw(curveimg)
+            nsamples = img.width + 1
+            xys = [(rng.randint(config['curve_start_offset'][0], img.width * config['curve_start_offset'][1]), 
+                    rng.randint(0, img.height))]
             j = 0
-            for i in range(random.randrange(*YC_SYNTH['curve_complexity'])):
+            for i in range(rng.randrange(*config['curve_complexity'])):
                 j += 1
-                xys.append((random.randint(xys[j-1][0] + 2, xys[j-1][0] + YC_SYNTH['curve_section_offset']), 
-                            random.randint(0, img.height)))
-            points.extend(make_bezier(xys)(ts))
-        draw.line(points, fill=YC_TEXTCOLOR, joint='curve')
-        img.paste(curveimg, (0, 0), curveimg)
+                xys.append((rng.randint(xys[j-1][0] + 2, xys[j-1][0] + config['curve_section_offset']), 
+                            rng.randint(0, img.height)))
+            points = [bezier_points(xys, nsamples)]
+            for k in range(rng.randrange(*config['curve_sections'])):
+                xys = [xys[-1]]
+                j = 0
+                for i in range(rng.randrange(*config['curve_complexity'])):
+                    j += 1
+                    xys.append((rng.randint(xys[j-1][0] + 2, xys[j-1][0] + config['curve_section_offset']), 
+                                rng.randint(0, img.height)))
+                points.append(bezier_points(xys, nsamples))
+            # PIL reads a contiguous float32 buffer as a flat list of (x, y) pairs
+            draw.line(np.ascontiguousarray(np.concatenate(points), dtype=np.float32), fill=YC_TEXTCOLOR, joint='curve')
+            img.paste(curveimg, (0, 0), curveimg)
         
     # add yandex logo
-    logo_file = '../assets/yandex-for-white-background_{}.png'.format(logo_country)
-    logo_img = Image.open(logo_file)
-    logo_img = logo_img.resize( tuple(int(x * YC_SYNTH['logo_resize']) for x in logo_img.size) )
-    img.paste(logo_img, (img.width - logo_img.width, 0), logo_img)
+    with stage('logo'):
+        logo_img = get_logo(logo_country)
+        img.paste(logo_img, (img.width - logo_img.width, 0), logo_img)
     
+    return digits, img
+
+def sample_seed(seed, index):
+    """
+    Derives the seed of the index-th sample of a dataset from the dataset's seed.
+    """
+    state = np.random.SeedSequence([seed, index]).generate_state(2, dtype=np.uint32)
+    return (int(state[0]) << 32) | int(state[1])
+
+def sample_rng(seed, index):
+    """
+    Returns an independent random generator of the index-th sample of a dataset
+    (each sample can thus be regenerated on its own, see synth_sample()).
+    """
+    return random.Random(sample_seed(seed, index))
+
+def synth_sample(index, seed, logo_country='en', config=None):
+    """
+    Deterministically (re)generates the index-th captcha of the dataset with the given seed (and config).
+    RETURNS:
+        tuple (digits [str], image [PIL RGBA Image])
+    """
+    return render_captcha(logo_country, sample_rng(seed, index), config)
+
+def synth_captcha(logo_country='en', rng=None, name=None, config=None):
+    """
+    Generates a captcha with render_captcha() and saves it as PNG to SAVE_FOLDER.
+    The file is named "<digits>__<name>.png" (name = random UUID by default).
+    RETURNS:
+        tuple (digits [str], file path [str])
+    """
+    digits, img = render_captcha(logo_country, rng, config)
     # save final image  
-    fname = '{}/{}__{}.png'.format(SAVE_FOLDER, digits, str(uuid.uuid4()).replace('-', ''))
-    img.save(fname)
+    with stage('save'):
+        fname = '{}/{}__{}.png'.format(resource_path(SAVE_FOLDER), digits, name or str(uuid.uuid4()).replace('-', ''))
+        img.save(fname)
     #img.show()
     return digits, fname
 
-def generate_captchas():
-    # start Dask distributed client with 4 processes / 1 thread per process
-    client = DaskClient(n_workers=6, threads_per_worker=1)
-    # submit future functions to cluster
-    futures = []
-    for i in range(10000): 
-        futures.append(client.submit(synth_captcha, pure=False))
-    # execute and compute results (synchronous / blocking!)
-    results = client.gather(futures)
-    print(len(results))
-    # stop & release client
-    client.close()
+def synth_batch(n, seed=None, rgba=False, logo_country='en', start=0, rng=None, config=None, memo={}):
+    """
+    Generates a batch of captchas in memory, without writing any files.
+    The output arrays are preallocated once per (n, rgba) and reused by subsequent calls,
+    so copy them if they must outlive the next call.
+    PARAMS:
+        - n [int]: batch size
+        - seed [int]: OPTIONAL: dataset seed: the batch holds samples start...start+n-1
+                      of this dataset (see synth_sample())
+        - rgba [bool]: if True, return channels-last RGBA images instead of grayscale
+        - logo_country [str]: 'en' or 'ru' logo
+        - start [int]: index of the batch's first sample in the dataset (used with seed)
+        - rng [random.Random]: OPTIONAL: random generator used if seed is None (default = global 'random' module)
+        - config [dict]: OPTIONAL: synthesis parameters of this batch (default = YC_SYNTH), see synth_config()
+    RETURNS:
+        tuple (images [uint8 ndarray (n, YC_HEIGHT, YC_WIDTH) or (n, YC_HEIGHT, YC_WIDTH, 4)],
+               labels [uint8 ndarray (n, YC_LENGTH)] of digit indices in YC_CHARS)
+    """
+    key = (n, rgba)
+    if not key in memo:
+        memo[key] = (np.empty((n, YC_HEIGHT, YC_WIDTH, 4) if rgba else (n, YC_HEIGHT, YC_WIDTH), dtype=np.uint8),
+                     np.empty((n, YC_LENGTH), dtype=np.uint8))
+    images, labels = memo[key]
+    for i in range(n):
+        digits, img = render_captcha(logo_country, rng if seed is None else sample_rng(seed, start + i), config)
+        images[i] = np.asarray(img if rgba else img.convert('L'))
+        labels[i] = [YC_CHARS.index(c) for c in digits]
+    return images, labels
+
+def _init_worker():
+    # load fonts & logos once in each worker process
+    warmup_resources()
+    # forked workers inherit the parent's random state, so reseed them from OS entropy
+    # (but not the caller's own state when the serial executor runs this in the main process)
+    if not mp.parent_process() is None: random.seed()
+
+def _synth_task(i, logo_country='en', seed=None, config=None):
+    if seed is None: return synth_captcha(logo_country, config=config)
+    return synth_captcha(logo_country, sample_rng(seed, i), '{}_{:08d}'.format(seed, i), config)
+
+def _synth_array_task(i, logo_country='en', seed=None, config=None):
+    digits, img = render_captcha(logo_country, None if seed is None else sample_rng(seed, i), config)
+    with stage('to_array'):
+        return i, digits, np.asarray(img.convert('L'))
+
+def generate_captchas(count=10000, backend='process', workers=None, chunksize=None, logo_country='en', shard_dir=None, 
+                      profile=False, profile_file=None, seed=None, config=None):
+    """
+    Generates captchas with synth_captcha() and saves them to SAVE_FOLDER
+    (or packs them into a sharded dataset, see utils.shards).
+    PARAMS:
+        - count [int]: number of captchas to generate
+        - backend [str]: executor backend: 'serial', 'process' or 'dask'
+        - workers [int]: number of worker processes (None = number of available cores)
+        - chunksize [int]: number of captchas per submitted task (None = auto, at most JOB_CHUNKSIZE in background jobs)
+        - logo_country [str]: 'en' or 'ru' logo
+        - shard_dir [str]: OPTIONAL: if set, write grayscale images to shards in this directory 
+                           instead of PNG files to SAVE_FOLDER
+        - profile [bool]: if True, collect per-stage timings from all workers and print a summary
+        - profile_file [str]: OPTIONAL: save the collected timings to this file (see StageProfiler.dump())
+        - seed [int]: OPTIONAL: dataset seed; the i-th captcha is generated with sample_rng(seed, i),
+                      so it can be regenerated with synth_sample(i, seed) regardless of the worker running it;
+                      None = non-reproducible (each worker uses its own randomly seeded generator)
+        - config [dict]: OPTIONAL: synthesis parameters (default = YC_SYNTH), see synth_config()
+    RETURNS:
+        list of (digits, file path) tuples; if shard_dir is set, list of (digits, global index in shards)
+    """
+    if shard_dir is None: os.makedirs(resource_path(SAVE_FOLDER), exist_ok=True)
+    task = partial(_synth_task if shard_dir is None else _synth_array_task, logo_country=logo_country, seed=seed, config=config)
+    profiler = StageProfiler() if profile else None
+    if profile: task = partial(profiled_call, task)
+    
+    def results_of(executor):
+        for i, res in enumerate(executor.map(task, range(count), chunksize), 1):
+            if profile:
+                res, stats = res
+                profiler.merge(stats)
+            report_progress(i, count)
+            yield res
+            
+    with get_executor(backend, workers, initializer=_init_worker) as executor:
+        if not chunksize:
+            chunksize = auto_chunksize(count, executor.workers)
+            # progress is reported (and cancellation checked) only as whole chunks come back
+            if current_job(): chunksize = min(chunksize, JOB_CHUNKSIZE)
+        if shard_dir is None:
+            results = list(results_of(executor))
+        else:
+            results = []
+            with ShardWriter(shard_dir, (YC_HEIGHT, YC_WIDTH)) as writer:
+                for i, digits, arr in results_of(executor):
+                    writer.append(arr, digits, None if seed is None else {'seed': seed, 'sample': i})
+                    results.append((digits, writer.offset + writer.total - 1))
+    if profile:
+        print(profiler.summary())
+        if profile_file: profiler.dump(profile_file)
+    return results
 
 
 ## ******************************************************************************** ##         
 if __name__ == '__main__':
-    generate_captchas()
\ No newline at end of file
+    print(len(generate_captchas()))
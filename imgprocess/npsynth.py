@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a batched NumPy captcha synthesis engine.
+It follows the same steps as capprocess.render_captcha(), but renders a whole batch of
+grayscale captchas at once into a single preallocated (N, H, W) uint8 canvas:
+    - digit glyphs come from the pre-rendered glyph atlas (as alpha masks)
+    - digit rotations are applied by vectorized nearest-neighbor inverse mapping
+      (cached per glyph and angle)
+    - curves are sampled with the batched Bezier evaluator and rasterized as 1 px points
+    - glyphs and the logo are alpha-composited with integer arithmetic
+Output is statistically equivalent to render_captcha() (same parameter distributions),
+but not pixel-identical for the same seed.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from .capprocess import (YC_CHARS, YC_LENGTH, YC_WIDTH, YC_HEIGHT, YC_SYNTH,
+                         get_glyph, get_logo, bezier_points)
+
+
+def glyph_atlas(config=None, memo={}):
+    """
+    Stacks the outlined glyphs of all digits / fonts / sizes in the config (default = YC_SYNTH) into one array.
+    Glyph index = (font index * number of sizes + size index) * len(YC_CHARS) + digit index.
+    RETURNS:
+        tuple (alpha masks [uint8 (G, GH, GW)], glyph image sizes [int (G, 2) = w, h],
+               text sizes [int (G, 2) = w, h])
+    """
+    if config is None: config = YC_SYNTH
+    key = (tuple(config['digit_fonts']), tuple(config['digit_font_sizes']))
+    if key in memo: return memo[key]
+    glyphs = [get_glyph(font_file, font_size, digit) for font_file in config['digit_fonts']
+              for font_size in config['digit_font_sizes'] for digit in YC_CHARS]
+    gh = max(img.height for img, _ in glyphs)
+    gw = max(img.width for img, _ in glyphs)
+    masks = np.zeros((len(glyphs), gh, gw), dtype=np.uint8)
+    dims = np.zeros((len(glyphs), 2), dtype=np.int64)
+    text_sizes = np.zeros((len(glyphs), 2), dtype=np.int64)
+    for i, (img, digit_sz) in enumerate(glyphs):
+        masks[i, :img.height, :img.width] = np.asarray(img)[..., 3]
+        dims[i] = img.size
+        text_sizes[i] = digit_sz
+    memo[key] = (masks, dims, text_sizes)
+    return memo[key]
+
+def logo_arrays(logo_country='en', memo={}):
+    """
+    RETURNS:
+        tuple (grayscale [uint16 (h, w)], alpha [uint16 (h, w)]) of the resized Yandex logo
+    """
+    if not logo_country in memo:
+        logo = get_logo(logo_country)
+        gray = np.asarray(logo.convert('L'), dtype=np.uint16)
+        alpha = np.asarray(logo.convert('RGBA'), dtype=np.uint16)[..., 3]
+        memo[logo_country] = (gray, alpha)
+    return memo[logo_country]
+
+def rotate_masks(masks, dims, glyphs, angles):
+    """
+    Rotates glyph masks around their centers (as Image.rotate() with NEAREST resampling).
+    PARAMS:
+        - masks [uint8 (G, GH, GW)]: glyph atlas masks
+        - dims [int (G, 2)]: glyph image sizes (w, h)
+        - glyphs [int (N,)]: glyph indices
+        - angles [int (N,)]: rotation angles in degrees (counter-clockwise)
+    RETURNS:
+        uint8 (N, GH, GW) rotated masks
+    """
+    ng, gh, gw = masks.shape
+    w = dims[glyphs, 0][:, None, None].astype(np.float32)
+    h = dims[glyphs, 1][:, None, None].astype(np.float32)
+    cx, cy = w / 2, h / 2
+    theta = -np.asarray(angles, dtype=np.float32)[:, None, None] / np.float32(180.0 / np.pi)
+    cosine, sine = np.cos(theta), np.sin(theta)
+    # output pixel centers mapped back to the source glyph (see capprocess.srt_matrix())
+    xs = np.arange(gw, dtype=np.float32)[None, None, :] + 0.5
+    ys = np.arange(gh, dtype=np.float32)[None, :, None] + 0.5
+    xin = np.floor(cosine * (xs - cx) + sine * (ys - cy) + cx).astype(np.intp)
+    yin = np.floor(cosine * (ys - cy) - sine * (xs - cx) + cy).astype(np.intp)
+    valid = (xin >= 0) & (xin < w) & (yin >= 0) & (yin < h) & (xs < w) & (ys < h)
+    # gather from the flattened atlas; invalid pixels read the zero pixel appended at its end
+    flat = np.where(valid, (glyphs[:, None, None] * gh + yin) * gw + xin, ng * gh * gw)
+    return _flat_masks(masks).take(flat)
+
+def _flat_masks(masks, memo={}):
+    key = id(masks)
+    if not key in memo: memo[key] = np.append(masks.ravel(), np.uint8(0))
+    return memo[key]
+
+def rotated_glyphs(glyphs, angles, config=None, memo={}):
+    """
+    Returns the glyph masks rotated by the given total angles. Each (glyph, angle) pair
+    is rotated once per process and cached (rotation angles are integers within
+    transform_times * skew_angles, so the cache is bounded: about 50 MB for YC_SYNTH).
+    RETURNS:
+        uint8 (N, GH, GW) rotated masks
+    """
+    if config is None: config = YC_SYNTH
+    masks, dims, _ = glyph_atlas(config)
+    lo, hi = (x * config['transform_times'] for x in config['skew_angles'])
+    key = (id(masks), lo, hi)
+    if not key in memo:
+        # np.zeros doesn't commit memory until the pages are written
+        memo[key] = (np.zeros((masks.shape[0], hi - lo + 1) + masks.shape[1:], dtype=np.uint8),
+                     np.zeros((masks.shape[0], hi - lo + 1), dtype=bool))
+    cache, built = memo[key]
+    angle_i = angles - lo
+    missing = ~built[glyphs, angle_i]
+    if missing.any():
+        pairs = np.unique(np.stack((glyphs[missing], angle_i[missing]), axis=1), axis=0)
+        cache[pairs[:, 0], pairs[:, 1]] = rotate_masks(masks, dims, pairs[:, 0], pairs[:, 1] + lo)
+        built[pairs[:, 0], pairs[:, 1]] = True
+    return cache[glyphs, angle_i]
+
+def sample_params(n, rng, config=None):
+    """
+    Samples all random parameters of a batch of n captchas up front (as in capprocess.render_captcha()).
+    PARAMS:
+        - n [int]: batch size
+        - rng [numpy.random.Generator]: random generator
+        - config [dict]: OPTIONAL: synthesis parameters (default = YC_SYNTH), see capprocess.synth_config()
+    RETURNS:
+        dict of arrays:
+            - 'labels' [(n, YC_LENGTH)]: digit indices in YC_CHARS
+            - 'glyphs', 'angles', 'xs', 'ys' [(n, YC_LENGTH)]: glyph atlas indices, total rotation angles, 
+              digit positions
+            - 'curve_degrees' [(n, ncurves, nsections)]: Bezier degrees of curve sections (0 = unused section)
+            - 'curve_xs', 'curve_ys' [(n, ncurves, npoints)]: control points of curve sections,
+              each section starting at the last point of the previous one
+        and the config under 'config'
+    """
+    if config is None: config = YC_SYNTH
+    _, _, text_sizes = glyph_atlas(config)
+    params = {'config': config}
+
+    # digits, fonts, sizes -> glyph indices
+    nsizes = len(config['digit_font_sizes'])
+    labels = rng.integers(0, len(YC_CHARS), size=(n, YC_LENGTH))
+    fonts = rng.integers(0, len(config['digit_fonts']), size=(n, YC_LENGTH))
+    sizes = rng.integers(0, nsizes, size=(n, YC_LENGTH))
+    glyphs = (fonts * nsizes + sizes) * len(YC_CHARS) + labels
+    # total rotation of transform_times successive rotations
+    lo, hi = config['skew_angles']
+    params['angles'] = rng.integers(lo, hi + 1, size=(n, YC_LENGTH, config['transform_times'])).sum(axis=-1)
+    # digit offsets: each digit is shifted by its width minus a random overlap
+    widths = text_sizes[glyphs, 0]
+    heights = text_sizes[glyphs, 1]
+    overlaps = rng.integers(np.floor(-widths / config['digit_hzoffset'][0]).astype(np.int64),
+                            np.floor(-widths / config['digit_hzoffset'][1]).astype(np.int64) + 1)
+    params['xs'] = np.clip(1 + np.cumsum(widths + overlaps, axis=-1), 0, YC_WIDTH)
+    params['ys'] = rng.integers(1, np.maximum(2, YC_HEIGHT - heights - 15) + 1)
+    params['labels'], params['glyphs'] = labels, glyphs
+
+    # curves
+    ncurves = config['curve_number']
+    cc0, cc1 = config['curve_complexity']
+    cs0, cs1 = config['curve_sections']
+    nsections = cs1                         # 1 starting section + up to cs1 - 1 more
+    npoints = 1 + nsections * (cc1 - 1)
+    degrees = rng.integers(cc0, cc1, size=(n, ncurves, nsections))
+    active = np.arange(nsections)[None, None, :] < 1 + rng.integers(cs0, cs1, size=(n, ncurves))[..., None]
+    params['curve_degrees'] = np.where(active, degrees, 0)
+    x0 = rng.integers(int(config['curve_start_offset'][0]), int(YC_WIDTH * config['curve_start_offset'][1]) + 1, size=(n, ncurves, 1))
+    steps = rng.integers(2, config['curve_section_offset'] + 1, size=(n, ncurves, npoints - 1))
+    params['curve_xs'] = np.concatenate((x0, x0 + np.cumsum(steps, axis=-1)), axis=-1)
+    params['curve_ys'] = rng.integers(0, YC_HEIGHT + 1, size=(n, ncurves, npoints))
+    return params
+
+def curve_points(params):
+    """
+    Evaluates the curve sections sampled by sample_params().
+    RETURNS:
+        tuple (image index [int (M,)], point coordinates [float (M, 2)]) for M sampled points
+    """
+    degrees, xs, ys = params['curve_degrees'], params['curve_xs'], params['curve_ys']
+    starts = np.cumsum(degrees, axis=-1) - degrees
+    owners, points = [np.zeros(0, dtype=np.int64)], [np.zeros((0, 2))]
+    # evaluate sections of the same degree in one batch
+    for degree in np.unique(degrees[degrees > 0]):
+        img_i, curve_i, section_i = np.nonzero(degrees == degree)
+        idx = starts[img_i, curve_i, section_i][:, None] + np.arange(degree + 1)[None, :]
+        ctrl = np.stack((xs[img_i[:, None], curve_i[:, None], idx], ys[img_i[:, None], curve_i[:, None], idx]), axis=-1)
+        # a section moves at most degree * (largest control point step) px per unit of the curve parameter
+        # along each axis, so this many samples keep consecutive points < 1 px apart (no gaps after rounding)
+        nsamples = int(degree * np.abs(np.diff(ctrl, axis=1)).max()) + 2
+        owners.append(np.repeat(img_i, nsamples))
+        points.append(bezier_points(ctrl, nsamples).reshape(-1, 2))
+    return np.concatenate(owners), np.concatenate(points)
+
+def synth_batch_np(n, seed=None, logo_country='en', config=None):
+    """
+    Generates a batch of grayscale captchas with vectorized NumPy operations.
+    The output arrays are preallocated once per batch size and reused by subsequent calls.
+    PARAMS:
+        - n [int]: batch size
+        - seed [int or numpy.random.Generator]: OPTIONAL: random seed / generator
+        - logo_country [str]: 'en' or 'ru' logo
+        - config [dict]: OPTIONAL: synthesis parameters of this batch (default = YC_SYNTH), see capprocess.synth_config()
+    RETURNS:
+        tuple (images [uint8 ndarray (n, YC_HEIGHT, YC_WIDTH)],
+               labels [uint8 ndarray (n, YC_LENGTH)] of digit indices in YC_CHARS)
+    """
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    return render_batch(sample_params(n, rng, config), logo_country)
+
+def render_batch(params, logo_country='en', memo={}):
+    """
+    Renders a batch of captchas from parameters sampled by sample_params().
+    RETURNS:
+        same as synth_batch_np()
+    """
+    n = len(params['labels'])
+    masks, _, _ = glyph_atlas(params['config'])
+    _, gh, gw = masks.shape
+    key = (n, gh, gw)
+    if not key in memo:
+        # the canvas is padded by one glyph size, so that glyphs can be pasted without clipping
+        memo[key] = (np.empty((n, YC_HEIGHT + gh, YC_WIDTH + gw), dtype=np.uint8), np.empty((n, YC_LENGTH), dtype=np.uint8))
+    canvas, labels = memo[key]
+    canvas.fill(255)
+    labels[:] = params['labels']
+    glyphs, angles, xs, ys = params['glyphs'], params['angles'], params['xs'], params['ys']
+
+    # composite digits (black ink with glyph alpha) one position at a time;
+    # windows[i, y, x] is the glyph-sized view of image i at (x, y), so all images are blended at once
+    windows = sliding_window_view(canvas, (gh, gw), axis=(1, 2), writeable=True)
+    img_i = np.arange(n)
+    for j in range(YC_LENGTH):
+        transparency = 255 - rotated_glyphs(glyphs[:, j], angles[:, j], params['config']).astype(np.uint16)
+        windows[img_i, ys[:, j], xs[:, j]] = (windows[img_i, ys[:, j], xs[:, j]] * transparency + 127) // 255
+
+    # curves (black, 1 px)
+    owners, points = curve_points(params)
+    px = np.rint(points.astype(np.float32)).astype(np.int32)
+    x, y = px[..., 0], px[..., 1]
+    inside = (x >= 0) & (x < YC_WIDTH) & (y >= 0) & (y < YC_HEIGHT)
+    flat = (owners.astype(np.int64) * canvas.shape[1] + y) * canvas.shape[2] + x
+    canvas.reshape(-1)[flat[inside]] = 0
+
+    # logo in the top right corner
+    logo_gray, logo_alpha = logo_arrays(logo_country)
+    lh, lw = logo_alpha.shape
+    region = canvas[:, :lh, YC_WIDTH - lw:YC_WIDTH]
+    region[:] = (region * (255 - logo_alpha) + logo_gray * logo_alpha + 127) // 255
+
+    return canvas[:, :YC_HEIGHT, :YC_WIDTH], labels
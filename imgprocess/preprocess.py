@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module turns downloaded captchas (GIF / JPG / PNG of any size) into model-ready
+YC_HEIGHT x YC_WIDTH grayscale arrays matching the synthetic data, packed into a sharded
+dataset (see utils.shards). Files are decoded and resized in worker processes in chunks,
+and each chunk is binarized / normalized and logo-masked as one (N, H, W) array.
+"""
+
+import os
+import io
+import hashlib
+import numpy as np
+from functools import partial
+from PIL import Image
+from .capprocess import YC_WIDTH, YC_HEIGHT, get_logo
+from utils.executors import get_executor
+from utils.shards import ShardWriter, shard_files, read_shard_index
+from utils.manifest import label_from_name
+from utils.utils import iter_files
+from utils.labels import LabelStore, LABELS_FILE
+from utils.jobs import report_progress
+
+PREP_MODES = ('gray', 'binary', 'normalize')
+PREP_IMGTYPES = ('gif', 'jpg', 'jpeg', 'png')
+PREP_CHUNK = 64                 # files per worker task
+
+def otsu_thresholds(images):
+    """
+    Computes Otsu's binarization threshold of each image in a batch.
+    PARAMS:
+        - images [uint8 (N, H, W)]: grayscale images
+    RETURNS:
+        uint8 (N,) thresholds (pixels > threshold are background)
+    """
+    n = len(images)
+    hist = np.bincount((np.arange(n)[:, None] * 256 + images.reshape(n, -1)).ravel(), minlength=n * 256).reshape(n, 256)
+    levels = np.arange(256, dtype=np.float64)
+    # class weights and means for every candidate threshold t (class 0 = pixels <= t)
+    w0 = np.cumsum(hist, axis=1, dtype=np.float64)
+    w1 = w0[:, -1:] - w0
+    s0 = np.cumsum(hist * levels, axis=1)
+    s1 = s0[:, -1:] - s0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = w0 * w1 * (s0 / w0 - s1 / w1) ** 2
+    between[~np.isfinite(between)] = -1
+    return np.argmax(between, axis=1).astype(np.uint8)
+
+def binarize(images, threshold=None):
+    """
+    Binarizes a batch of grayscale images in place to black (0) ink on white (255).
+    PARAMS:
+        - threshold [int]: OPTIONAL: global threshold (None = Otsu's threshold per image)
+    """
+    thresholds = otsu_thresholds(images) if threshold is None else np.full(len(images), threshold, dtype=np.uint8)
+    np.copyto(images, np.where(images > thresholds[:, None, None], np.uint8(255), np.uint8(0)))
+    return images
+
+def normalize(images):
+    """
+    Stretches the contrast of each image in a batch in place to the full 0...255 range.
+    """
+    lo = images.min(axis=(1, 2), keepdims=True).astype(np.uint16)
+    hi = images.max(axis=(1, 2), keepdims=True).astype(np.uint16)
+    span = np.maximum(hi - lo, 1)
+    np.copyto(images, ((images - lo) * 255 // span).astype(np.uint8))
+    return images
+
+def mask_logo(images, logo_country='en'):
+    """
+    Paints the logo region (top right corner, see capprocess.render_captcha()) white in place.
+    """
+    logo = get_logo(logo_country)
+    images[:, :logo.height, YC_WIDTH - logo.width:] = 255
+    return images
+
+def load_images(files):
+    """
+    Decodes and resizes image files into one grayscale batch.
+    RETURNS:
+        tuple (uint8 (N, YC_HEIGHT, YC_WIDTH) array, list of N content hashes) for N files
+        (undecodable files get an empty hash and a blank image)
+    """
+    images = np.full((len(files), YC_HEIGHT, YC_WIDTH), 255, dtype=np.uint8)
+    hashes = []
+    for i, imgfile in enumerate(files):
+        try:
+            with open(imgfile, 'rb') as f:
+                data = f.read()
+            with Image.open(io.BytesIO(data)) as img:
+                img = img.convert('L')
+                if img.size != (YC_WIDTH, YC_HEIGHT): img = img.resize((YC_WIDTH, YC_HEIGHT), Image.BILINEAR)
+                images[i] = np.asarray(img)
+            hashes.append(hashlib.sha1(data).hexdigest())
+        except Exception:
+            hashes.append('')
+    return images, hashes
+
+def _preprocess_chunk(files, mode='binary', threshold=None, logo=True, logo_country='en'):
+    images, hashes = load_images(files)
+    if logo: mask_logo(images, logo_country)
+    if mode == 'binary':
+        binarize(images, threshold)
+    elif mode == 'normalize':
+        normalize(images)
+    return files, hashes, images
+
+def preprocessed_files(shard_dir):
+    """
+    RETURNS:
+        set of source files already packed into the dataset in shard_dir
+    """
+    files = set()
+    for npy_path in shard_files(shard_dir):
+        index = read_shard_index(npy_path)
+        if index: files.update(meta.get('file', '') for meta in index['meta'])
+    return files
+
+def preprocess_captchas(imgdir, shard_dir, mode='binary', threshold=None, logo=True, logo_country='en', recurse=False,
+                        imgtypes=PREP_IMGTYPES, incremental=True, label_dir=None, workers=None, backend='process', chunk=PREP_CHUNK):
+    """
+    Preprocesses all captcha images in a directory and appends them to the sharded dataset in shard_dir.
+    PARAMS:
+        - imgdir [str]: directory with downloaded captchas
+        - shard_dir [str]: output dataset directory
+        - mode [str]: 'gray' (decode & resize only), 'binary' (black ink on white) or 'normalize' (contrast stretch)
+        - threshold [int]: OPTIONAL: binarization threshold (None = Otsu's threshold per image)
+        - logo [bool]: paint the logo region white
+        - logo_country [str]: 'en' or 'ru' logo (defines the logo region size)
+        - recurse [bool]: process subdirectories too
+        - imgtypes [tuple]: image file extensions
+        - incremental [bool]: skip files already in the dataset (recorded in its metadata)
+        - label_dir [str]: OPTIONAL: directory of an existing label store (see utils.labels) to take labels from;
+                           otherwise (or if not found there) labels are taken from '<label>__*' file names
+        - workers [int]: number of worker processes (None = all cores)
+        - backend [str]: executor backend: 'serial', 'process' or 'dask'
+        - chunk [int]: files per worker task
+    RETURNS:
+        number of images added to the dataset
+    """
+    if not mode in PREP_MODES:
+        raise Exception('Unknown mode "{}", must be one of: {}'.format(mode, ', '.join(PREP_MODES)))
+    done = preprocessed_files(shard_dir) if incremental else set()
+    files = [f for f in iter_files(imgdir, recurse, imgtypes) if not f in done]
+    if not files: return 0
+    # don't create an empty store (a stray file that would also change the image directory's manifest)
+    store = LabelStore(label_dir) if label_dir and os.path.isfile(os.path.join(label_dir, LABELS_FILE)) else None
+    task = partial(_preprocess_chunk, mode=mode, threshold=threshold, logo=logo, logo_country=logo_country)
+    added = done = 0
+    try:
+        with get_executor(backend, workers) as executor, ShardWriter(shard_dir, (YC_HEIGHT, YC_WIDTH)) as writer:
+            chunks = [files[i:i + chunk] for i in range(0, len(files), chunk)]
+            for chunk_files, hashes, images in executor.map(task, chunks):
+                for imgfile, hash_, img in zip(chunk_files, hashes, images):
+                    if not hash_: continue
+                    label = (store.get(hash_, '') if store else '') or label_from_name(os.path.basename(imgfile))
+                    writer.append(img, label, {'file': imgfile, 'hash': hash_})
+                    added += 1
+                done += len(chunk_files)
+                report_progress(done, len(files))
+    finally:
+        if store: store.close()
+    return added
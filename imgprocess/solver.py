@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides the captcha solver: a trained Keras model run on the CPU,
+a micro-batcher gathering concurrent requests into batches and a local HTTP solving service:
+    POST /solve     body = image file (GIF / JPG / PNG); returns JSON {"label", "confidence", "latency_ms"}
+    GET  /stats     returns JSON latency / throughput metrics
+The model takes (N, YC_HEIGHT, YC_WIDTH, 1) float32 images in [0, 1] and returns either
+YC_LENGTH outputs of shape (N, len(YC_CHARS)) or one output of shape (N, YC_LENGTH, len(YC_CHARS)).
+"""
+
+import os
+import io
+import json
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .capprocess import YC_CHARS, YC_LENGTH, YC_WIDTH, YC_HEIGHT
+from .preprocess import PREP_MODES, binarize, normalize, mask_logo
+from utils.shards import to_gray_array
+
+MODEL_FILE = '../models/ycaptcha.h5'
+SOLVER_HOST = '127.0.0.1'
+SOLVER_PORT = 8765
+SOLVER_MAX_BATCH = 64           # max images per model call
+SOLVER_MAX_WAIT = 0.005         # max time (sec.) the first request of a batch waits for more requests
+SOLVER_THREADS = None           # TensorFlow intra-op threads (None = all cores)
+LATENCY_WINDOW = 10000          # number of recent request latencies kept for the percentiles
+
+def load_model(model_file=MODEL_FILE, threads=SOLVER_THREADS):
+    """
+    Loads a trained Keras model for CPU-only inference (TensorFlow is imported here, on first use).
+    """
+    # hide GPUs before TensorFlow is loaded
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+    return tf.keras.models.load_model(model_path(model_file), compile=False)
+
+def model_path(model_file=MODEL_FILE):
+    """
+    RETURNS:
+        absolute model file path: the default MODEL_FILE is relative to this module's directory,
+        other relative paths are relative to the current working directory
+    """
+    if model_file == MODEL_FILE:
+        return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), model_file))
+    return os.path.abspath(model_file)
+
+def decode_predictions(outputs):
+    """
+    Converts model outputs to labels.
+    RETURNS:
+        tuple (list of N label strings, float (N,) confidences = product of per-digit probabilities)
+    """
+    probs = np.stack(outputs, axis=1) if isinstance(outputs, (list, tuple)) else np.asarray(outputs)
+    probs = probs.reshape(len(probs), YC_LENGTH, len(YC_CHARS))
+    best = probs.argmax(axis=-1)
+    confidence = np.take_along_axis(probs, best[..., None], axis=-1)[..., 0].prod(axis=-1)
+    chars = np.array(list(YC_CHARS))
+    return [''.join(row) for row in chars[best]], confidence
+
+def prepare_images(images, mode='gray', logo=False):
+    """
+    Converts images (file paths, file bytes, PIL Images or arrays) to a model input batch.
+    PARAMS:
+        - mode [str]: preprocessing: 'gray', 'binary' or 'normalize' (must match the training data, see preprocess)
+        - logo [bool]: paint the logo region white
+    RETURNS:
+        float32 (N, YC_HEIGHT, YC_WIDTH, 1) array in [0, 1]
+    """
+    batch = np.empty((len(images), YC_HEIGHT, YC_WIDTH), dtype=np.uint8)
+    for i, img in enumerate(images):
+        batch[i] = to_gray_array(io.BytesIO(img) if isinstance(img, bytes) else img, (YC_HEIGHT, YC_WIDTH))
+    if logo: mask_logo(batch)
+    if mode == 'binary':
+        binarize(batch)
+    elif mode == 'normalize':
+        normalize(batch)
+    return (batch[..., None] / np.float32(255.0)).astype(np.float32)
+
+## ******************************************************************************** ##
+
+class Solver:
+    """
+    Captcha solver wrapping a model loaded once.
+    """
+
+    def __init__(self, model=MODEL_FILE, mode='gray', logo=False, threads=SOLVER_THREADS):
+        """
+        PARAMS:
+            - model [str or model]: model file or a loaded model (any object with a Keras-like predict())
+            - mode, logo: input preprocessing, see prepare_images()
+        """
+        if not mode in PREP_MODES:
+            raise Exception('Unknown mode "{}", must be one of: {}'.format(mode, ', '.join(PREP_MODES)))
+        self.model = load_model(model, threads) if isinstance(model, str) else model
+        self.mode = mode
+        self.logo = logo
+
+    def solve(self, images):
+        """
+        RETURNS:
+            tuple (list of labels, confidences) for the images (see prepare_images())
+        """
+        if not len(images): return [], np.zeros(0)
+        batch = prepare_images(images, self.mode, self.logo)
+        return decode_predictions(self.model.predict(batch, batch_size=len(batch), verbose=0))
+
+class MicroBatcher:
+    """
+    Gathers concurrent solving requests into batches of up to max_batch images:
+    a batch is run as soon as it's full or its first request has waited max_wait seconds.
+    Use like so:
+        with MicroBatcher(Solver()) as batcher:
+            label, confidence = batcher.submit(image_bytes).result()
+    """
+
+    def __init__(self, solver, max_batch=SOLVER_MAX_BATCH, max_wait=SOLVER_MAX_WAIT):
+        self.solver = solver
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._requests = 0
+        self._batches = 0
+        self._busy = 0.0
+        self._started = None
+
+    def start(self):
+        if self._thread: return self
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if not self._thread: return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, image):
+        """
+        Queues an image for solving.
+        RETURNS:
+            concurrent.futures.Future resolving to the (label, confidence) tuple
+        """
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None: return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None: break
+            t = time.perf_counter()
+            try:
+                labels, confidence = self.solver.solve([image for image, _, _ in batch])
+            except Exception as err:
+                for _, future, _ in batch: future.set_exception(err)
+                continue
+            done = time.perf_counter()
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._busy += done - t
+                self._latencies.extend(done - queued for _, _, queued in batch)
+                del self._latencies[:-LATENCY_WINDOW]
+            for (_, future, _), label, conf in zip(batch, labels, confidence):
+                future.set_result((label, float(conf)))
+
+    def stats(self):
+        """
+        RETURNS:
+            dict: request and batch counts, mean batch size, throughput (requests/sec since start),
+            model utilization and latency percentiles [ms] of recent requests
+        """
+        with self._lock:
+            elapsed = time.perf_counter() - self._started if self._started else 0.0
+            res = {'requests': self._requests, 'batches': self._batches,
+                   'mean_batch': self._requests / self._batches if self._batches else 0.0,
+                   'per_sec': self._requests / elapsed if elapsed else 0.0,
+                   'utilization': self._busy / elapsed if elapsed else 0.0}
+            if self._latencies:
+                for p, v in zip((50, 90, 99), np.percentile(self._latencies, (50, 90, 99))):
+                    res['p{}_ms'.format(p)] = v * 1000.0
+        return res
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+## ******************************************************************************** ##
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes: without TCP_NODELAY, Nagle + delayed ACK 
+    # add ~40 ms to every request on a keep-alive connection
+    disable_nagle_algorithm = True
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/stats'):
+            self._send_json(200, self.server.batcher.stats())
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if not self.path.startswith('/solve'):
+            self._send_json(404, {'error': 'Not found'})
+            return
+        t = time.perf_counter()
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            # decode in the connection's thread, so that a bad image fails only its own request
+            img = to_gray_array(io.BytesIO(data), (YC_HEIGHT, YC_WIDTH))
+        except Exception as err:
+            self._send_json(400, {'error': 'Cannot decode image: {}'.format(err)})
+            return
+        try:
+            label, confidence = self.server.batcher.submit(img).result()
+        except Exception as err:
+            self._send_json(500, {'error': str(err)})
+            return
+        self._send_json(200, {'label': label, 'confidence': confidence, 'latency_ms': (time.perf_counter() - t) * 1000.0})
+
+    def log_message(self, format, *args):
+        pass
+
+class SolverServer:
+    """
+    Local HTTP solving service running in a background thread (one thread per connection,
+    all requests are solved by one MicroBatcher).
+    """
+
+    def __init__(self, solver, host=SOLVER_HOST, port=SOLVER_PORT, max_batch=SOLVER_MAX_BATCH, max_wait=SOLVER_MAX_WAIT):
+        self.batcher = MicroBatcher(solver, max_batch, max_wait)
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.batcher = self.batcher
+        self.url = 'http://{}:{}'.format(*self.httpd.server_address[:2])
+        self._thread = None
+
+    def start(self):
+        self.batcher.start()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread: self._thread.join()
+        self.batcher.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
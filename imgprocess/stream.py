@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides an infinite stream of synthetic captcha batches
+produced by background worker processes.
+"""
+
+import multiprocessing as mp
+import queue
+import random
+from .capprocess import synth_batch, warmup_resources
+
+STREAM_PUT_TIMEOUT = 0.5        # how often (sec.) a blocked worker checks the stop event
+STREAM_GET_TIMEOUT = 0.5        # how often (sec.) a waiting consumer checks that the worker is alive
+
+def _stream_worker(worker, workers, seed, batch_size, rgba, logo_country, config, out_queue, stop_event):
+    warmup_resources()
+    # worker produces batches worker, worker + workers, worker + 2 * workers, ...
+    batch = worker
+    rng = random.Random() if seed is None else None
+    while not stop_event.is_set():
+        images, labels = synth_batch(batch_size, seed, rgba, logo_country, start=batch * batch_size, rng=rng, config=config)
+        batch += workers
+        # the batch buffers are reused by synth_batch, so send copies
+        data = (images.copy(), labels.copy())
+        while not stop_event.is_set():
+            try:
+                out_queue.put(data, timeout=STREAM_PUT_TIMEOUT)
+                break
+            except queue.Full:
+                continue
+
+class CaptchaStream:
+    """
+    Iterable that endlessly yields (images, labels) batches as returned by synth_batch().
+    Each worker process runs ahead of the consumer by at most 'prefetch' batches,
+    so memory is bounded by workers * prefetch batches. With a fixed seed, the i-th yielded batch 
+    holds samples i * batch_size ... (i + 1) * batch_size - 1 of the dataset with this seed
+    (see capprocess.synth_sample()), no matter how many workers produce them.
+    The synthesis parameters can be set with config (see capprocess.synth_config()).
+    Use like so:
+        with CaptchaStream(batch_size=64, seed=42) as stream:
+            for images, labels in stream:
+                ...
+    """
+
+    def __init__(self, batch_size=64, workers=None, prefetch=2, seed=None, rgba=False, logo_country='en', config=None):
+        self.batch_size = batch_size
+        self.workers = workers or max(1, mp.cpu_count() - 1)
+        self.prefetch = max(1, prefetch)
+        self.seed = seed
+        self.rgba = rgba
+        self.logo_country = logo_country
+        self.config = config
+        self._queues = []
+        self._procs = []
+        self._stop = None
+
+    def start(self):
+        if self._procs: return self
+        self._stop = mp.Event()
+        for worker in range(self.workers):
+            q = mp.Queue(maxsize=self.prefetch)
+            p = mp.Process(target=_stream_worker, daemon=True,
+                           args=(worker, self.workers, self.seed, self.batch_size, self.rgba, self.logo_country, self.config, q, self._stop))
+            p.start()
+            self._queues.append(q)
+            self._procs.append(p)
+        return self
+
+    def close(self):
+        if not self._procs: return
+        self._stop.set()
+        for q in self._queues:
+            # unblock feeder threads so that workers can exit
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+            q.cancel_join_thread()
+        for p in self._procs:
+            p.join(timeout=2 * STREAM_PUT_TIMEOUT)
+            if p.is_alive(): p.terminate()
+        self._queues = []
+        self._procs = []
+
+    def _get(self, worker):
+        q, p = self._queues[worker], self._procs[worker]
+        while True:
+            try:
+                return q.get(timeout=STREAM_GET_TIMEOUT)
+            except queue.Empty:
+                if p.exitcode is None: continue
+            # the worker has died: take the batch it may have sent before exiting, or fail
+            try:
+                return q.get_nowait()
+            except queue.Empty:
+                exitcode = p.exitcode
+                self.close()
+                raise Exception('Stream worker {} exited with code {}'.format(worker, exitcode))
+
+    def __iter__(self):
+        self.start()
+        while True:
+            for worker in range(len(self._queues)):
+                yield self._get(worker)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def stream_captchas(batch_size=64, nbatches=-1, **kwargs):
+    """
+    Generator yielding (images, labels) batches from a CaptchaStream.
+    PARAMS:
+        - batch_size [int]: captchas per batch
+        - nbatches [int]: how many batches to yield (-1 = infinite)
+        - kwargs: other CaptchaStream parameters (workers, prefetch, seed, rgba, logo_country, config)
+    """
+    with CaptchaStream(batch_size, **kwargs) as stream:
+        for i, batch in enumerate(stream):
+            if nbatches != -1 and i >= nbatches: break
+            yield batch
@@ -7,18 +7,36 @@ This file is part of the ycaptcha project hosted at https://github.com/S0mbre/yc
 This module provides a base class for the command-line interface (CLI).
 """
 
-import fire
 from .utils import *
+from .jobs import Job
+from .executors import set_persistent
 
 COMMAND_PROMPT = COLOR_PROMPT + '\nCOMMAND? [' + COLOR_STRESS + 'w' + COLOR_PROMPT + ' to quit] >'
 WRONG_CMD_MSG = COLOR_ERR + 'Wrong command! Type ' + COLOR_STRESS + 'h' + COLOR_ERR + ' for help.'
 EMPTY_CMD_MSG = COLOR_ERR + 'Empty command!'
 QUIT_CMD = 'w'
+JOB_SUFFIX = '&'                # command suffix to run it in the background
+JOB_QUIT_WAIT = 5               # how long (sec.) to wait for cancelled jobs to stop when quitting
+
+def fire_command(command, args, quiet=False):
+    """
+    Runs a command method with arguments parsed by fire (imported on first use, as it's slow to import).
+    PARAMS:
+        - quiet [bool]: don't print the command's result
+    RETURNS:
+        the command's result
+    """
+    import fire
+    try:
+        return fire.Fire(command, args, serialize=(lambda result: None) if quiet else None)
+    except fire.core.FireExit:
+        pass
        
 ## ******************************************************************************** ## 
 class CLIBase:
     
     def __init__(self):
+        self.jobs = {}
         self.commands = {f[4]: getattr(self, f) for f in dir(self) if callable(getattr(self, f)) and f.startswith('cmd_')}        
         self.commands[QUIT_CMD] = None
         self.usage = COLOR_HELP + COLOR_BRIGHT + '\nUSAGE:\t[{}] [value1] [value2] ... [--param3=value3] [--param4=value4] ...'.format('|'.join(sorted(self.commands.keys())))
@@ -35,6 +53,73 @@ class CLIBase:
         """
         print(self.usage)
         print(COLOR_HELP + 'Enter "h 2" to show more detail.' if detail < 2 else self.usage2)
+        print(COLOR_HELP + 'Add "{}" at the end of a command to run it in the background.'.format(JOB_SUFFIX))
+
+    def cmd_jobs(self, job=None):
+        """
+        Show background jobs (commands entered with "&" at the end).
+        PARAMS:
+            - job [int]: OPTIONAL: job ID to show the result / error of
+        RETURNS:
+            None
+        """
+        if not job is None:
+            j = self.jobs.get(int(job), None)
+            if j is None:
+                print_err('No job {}'.format(job))
+                return
+            print(COLOR_STRESS + '[{}] {} - {}, {}, {:.1f} s'.format(j.id, j.name, j.status, j.progress(), j.elapsed))
+            if not j.result is None: print(j.result)
+            if j.error: print_err(j.error)
+            return
+        if not self.jobs:
+            print(COLOR_HELP + 'No jobs')
+            return
+        for j in self.jobs.values():
+            print('[{}]\t{:<10}\t{:<18}\t{:>8.1f} s\t{}'.format(j.id, j.status, j.progress(), j.elapsed, j.name))
+
+    def cmd_kill(self, job):
+        """
+        Cancel a running background job (it stops at its next progress update).
+        PARAMS:
+            - job [int]: job ID (see "j")
+        RETURNS:
+            None
+        """
+        j = self.jobs.get(int(job), None)
+        if j is None or not j.running:
+            print_err('No running job {}'.format(job))
+            return
+        j.cancel()
+        print(COLOR_STRESS + '[{}] cancelling...'.format(j.id))
+
+    def start_job(self, command, args):
+        """
+        Runs the command in the background.
+        RETURNS:
+            Job instance
+        """
+        job_id = max(self.jobs, default=0) + 1
+        name = command.__name__[4:] + (' ' + args if args else '')
+        func = (lambda: fire_command(command, args, quiet=True)) if args else command
+        self.jobs[job_id] = job = Job(job_id, name, func, self.on_job_finished)
+        print(COLOR_STRESS + '[{}] started: {}'.format(job_id, name))
+        return job.start()
+
+    def on_job_finished(self, job):
+        # called in the job's thread
+        print(COLOR_STRESS + '\n[{}] {} ({:.1f} s): {}'.format(job.id, job.status, job.elapsed, job.name))
+        if job.error: print_err(job.error)
+        elif not job.result is None: print(job.result)
+        print(COMMAND_PROMPT, end='\t', flush=True)
+
+    def stop_jobs(self, wait=JOB_QUIT_WAIT):
+        """
+        Cancels all running jobs and waits for them to stop.
+        """
+        running = [j for j in self.jobs.values() if j.running]
+        for j in running: j.cancel()
+        for j in running: j.join(wait)
         
     def beforeRun(self):
         """
@@ -54,11 +139,15 @@ class CLIBase:
         The one-letter commands used are listed in the commands dict.
         """
         self.beforeRun()
+        # keep worker pools warm between commands
+        set_persistent(True)
         entered = ''
         while True:
             try:
                 print(COMMAND_PROMPT, end='\t')
-                entered = str(input())
+                entered = str(input()).strip()
+                background = entered.endswith(JOB_SUFFIX)
+                if background: entered = entered[:-len(JOB_SUFFIX)].rstrip()
                 if not entered:
                     print(EMPTY_CMD_MSG)
                     continue
@@ -67,8 +156,15 @@ class CLIBase:
                     if self.commands[e] is None: 
                         self.beforeQuit()
                         break
-                    cmds = entered.split(' ')                    
-                    fire.Fire(self.commands[e], ' '.join(cmds[1:]) if len(cmds) > 1 else '-') 
+                    cmds = entered.split(' ')
+                    if background:
+                        self.start_job(self.commands[e], ' '.join(cmds[1:]))
+                    elif len(cmds) > 1:
+                        fire_command(self.commands[e], ' '.join(cmds[1:]))
+                    else:
+                        # no arguments to parse: call the command directly
+                        result = self.commands[e]()
+                        if not result is None: print(result)
                 else:
                     print(WRONG_CMD_MSG)
                     self.cmd_help()
@@ -78,9 +174,10 @@ class CLIBase:
                 self.beforeQuit()
                 break
             
-            except fire.core.FireExit:
-                continue
-            
             except Exception as err:
                 print_err(str(err))
-                continue
\ No newline at end of file
+                continue
+
+        # stop background jobs and warm worker pools
+        self.stop_jobs()
+        set_persistent(False)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a persistent (SQLite) index of downloaded captchas keyed by content hash,
+used to skip duplicate images and resume interrupted downloads.
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+
+INDEX_FILE = 'download_index.sqlite'
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+## ******************************************************************************** ##
+
+class DownloadIndex:
+    """
+    Index of downloaded captchas stored in INDEX_FILE in the download directory.
+    Each record holds: content hash, source URL, saved file (or dataset index), format, label.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(os.path.abspath(directory), INDEX_FILE)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS captchas (hash TEXT PRIMARY KEY, url TEXT, file TEXT, '
+                          'format TEXT, label TEXT DEFAULT \'\', added REAL)')
+        self.conn.commit()
+
+    def __contains__(self, hash_):
+        return not self.conn.execute('SELECT 1 FROM captchas WHERE hash = ?', (hash_,)).fetchone() is None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM captchas').fetchone()[0]
+
+    def add(self, hash_, url, file, fmt, label=''):
+        """
+        Adds a record.
+        RETURNS:
+            True if added, False if the content hash is already indexed
+        """
+        cur = self.conn.execute('INSERT OR IGNORE INTO captchas (hash, url, file, format, label, added) VALUES (?, ?, ?, ?, ?, ?)',
+                                (hash_, url, str(file), fmt, label, time.time()))
+        self.conn.commit()
+        return cur.rowcount > 0
+
+    def get(self, hash_):
+        """
+        RETURNS:
+            dict record for the content hash or None
+        """
+        row = self.conn.execute('SELECT hash, url, file, format, label, added FROM captchas WHERE hash = ?', (hash_,)).fetchone()
+        return None if row is None else dict(zip(('hash', 'url', 'file', 'format', 'label', 'added'), row))
+
+    def stats(self):
+        """
+        RETURNS:
+            dict: total count, count per format, labeled count
+        """
+        formats = dict(self.conn.execute('SELECT format, COUNT(*) FROM captchas GROUP BY format').fetchall())
+        labeled = self.conn.execute('SELECT COUNT(*) FROM captchas WHERE label != \'\'').fetchone()[0]
+        return {'total': sum(formats.values()), 'formats': formats, 'labeled': labeled}
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
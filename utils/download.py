@@ -9,7 +9,12 @@ import os
 import requests
 import xml.etree.ElementTree as ET
 import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from .utils import *
+from .shards import ShardWriter
+from .dlindex import DownloadIndex, content_hash
 
 
 REQ_HEADERS = {'Content-Type': 'text/xhtml+xml; charset=UTF-8', 
@@ -17,19 +22,52 @@ REQ_HEADERS = {'Content-Type': 'text/xhtml+xml; charset=UTF-8',
                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36',
                'Accept-Charset': 'utf-8',
                'Accept-Language': 'ru,en-us',
-               'Connection': 'close', 
-               'X-Real-Ip': get_ip()}
+               'Connection': 'keep-alive'}
 SAMPLE_CAPTCHA_QUERY = 'e48a2b93de1740f48f6de0d45dc4192a'
+SAMPLE_CAPTCHA_URL = 'https://yandex.{domain}/search/xml?&query={query}&user={user}&key={apikey}&showmecaptcha=yes'
 IMAGE_TYPES = {'gif': '.gif', 'jpeg': '.jpg', 'png': '.png', 'jpg': '.jpg'}
+DOWNLOAD_WINDOW = 2             # max downloads in flight per connection (bounds the images held in memory)
 
 def get_node(node, nodename, default=''):
     nd = node.find(nodename)
     return nd.text if not nd is None else default
 
-def get_sample_captcha(user, apikey, domain='com', only_image=True):
+def get_req_headers():
+    """
+    Returns the request headers, including the external IP which is resolved 
+    on first use (not at import time) and cached by get_ip().
+    """
+    return dict(REQ_HEADERS, **{'X-Real-Ip': get_ip()})
+
+def make_session(pool_size=1):
+    """
+    Creates an HTTP session keeping up to pool_size connections per host alive.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def http_get(url, session=None, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+    """
+    GET request retrying on connection errors and HTTP 5xx / 429 responses with exponential backoff.
+    RETURNS:
+        the last response (raises the last exception if all attempts failed to connect)
+    """
+    getter = session.get if session else requests.get
+    for attempt in range(retries + 1):
+        try:
+            resp = getter(url, proxies=HTTP_PROXIES, timeout=HTTP_TIMEOUT, headers=get_req_headers())
+            if attempt == retries or (resp.status_code < 500 and resp.status_code != 429): return resp
+        except requests.RequestException:
+            if attempt == retries: raise
+        time.sleep(backoff * 2**attempt)
+
+def get_sample_captcha(user, apikey, domain='com', only_image=True, session=None, xml_url=SAMPLE_CAPTCHA_URL):
     try:
-        q = 'https://yandex.{}/search/xml?&query={}&user={}&key={}&showmecaptcha=yes'.format(domain, SAMPLE_CAPTCHA_QUERY, user, apikey)
-        resp = requests.get(q, proxies=HTTP_PROXIES, timeout=HTTP_TIMEOUT, headers=REQ_HEADERS) 
+        q = xml_url.format(domain=domain, query=SAMPLE_CAPTCHA_QUERY, user=user, apikey=apikey)
+        resp = http_get(q, session) 
         if resp.status_code != 200:
             raise Exception('Result of query "{}" cannot be retrieved, HTTP Error = {}'.format(q, resp.status_code))
             
@@ -42,7 +80,32 @@ def get_sample_captcha(user, apikey, domain='com', only_image=True):
         print_err(str(err))
         return None
 
-def download_sample_captchas(user, apikey, domain='com', ncap=1, directory=None, cback=None):
+def fetch_captcha(user, apikey, domain='com', session=None, xml_url=SAMPLE_CAPTCHA_URL):
+    """
+    Retrieves a sample captcha image URL and downloads the image.
+    RETURNS:
+        tuple (url, image type, image bytes) or None on error
+    """
+    url = get_sample_captcha(user, apikey, domain, session=session, xml_url=xml_url)
+    if not url:
+        print_err('Error downloading captcha! No image URL!')
+        return None
+    try:
+        res = http_get(url, session)
+        if res.status_code != 200:
+            print_err('Error downloading captcha! HTTP Error = {}'.format(res.status_code))
+            return None
+        ftype = res.headers['Content-Type'].split('/')[-1].split(';')[0] if 'Content-Type' in res.headers else 'gif'
+        if not ftype in IMAGE_TYPES:
+            print_err('Wrong image format: ' + ftype)
+            return None
+        return url, ftype, res.content
+    except Exception as err:
+        print_err(str(err))
+        return None
+
+def download_sample_captchas(user, apikey, domain='com', ncap=1, directory=None, cback=None, shard_dir=None, 
+                             concurrency=1, xml_url=SAMPLE_CAPTCHA_URL, resume=False, saveas=None):
     """
     Downloads requested number of Yandex captchas as [GIF] images to indicated directory.
     PARAMS:
@@ -53,43 +116,97 @@ def download_sample_captchas(user, apikey, domain='com', ncap=1, directory=None,
         - directory [str]: the save directory; if None, the current dir's "imgset" folder will be used
         - cback [object]: callback function returning the original downloaded file path or a new one; 
                           if the return results evaluates to False (e.g. empty string), downloading will stop
+        - shard_dir [str]: OPTIONAL: if set, pack the images as grayscale IMG_SHAPE arrays into shards 
+                           in this directory (see utils.shards) instead of saving separate files;
+                           cback and the returned list then get global dataset indices instead of file paths
+        - concurrency [int]: number of captchas downloaded in parallel (over a pool of keep-alive connections)
+        - xml_url [str]: Yandex XML query URL template (can point to a local test server)
+        - resume [bool]: if True, ncap is the total number of captchas wanted in the directory,
+                         so only the ones missing from its download index are retrieved
+        - saveas [str]: OPTIONAL: image format (e.g. 'jpg') to convert the downloaded images to
+                        in memory before saving; None = save as downloaded
+    Downloaded images are recorded in the directory's download index (see utils.dlindex);
+    images whose content is already indexed are skipped as duplicates.
     """
     root = directory if not directory is None else os.path.abspath(IMG_DIRECTORY)
     if not os.path.isdir(root): os.makedirs(root)
-    
+    shards = ShardWriter(shard_dir, IMG_SHAPE) if shard_dir else None
+    index = DownloadIndex(shard_dir or root)
+    try:
+        if resume: 
+            ncap = max(0, ncap - len(index))
+            print_dbg('{} captchas already downloaded, {} to go'.format(len(index), ncap))
+        return _download_captchas(user, apikey, domain, ncap, root, cback, shards, index, concurrency, xml_url, saveas)
+    finally:
+        index.close()
+        if shards: shards.close()
+
+def _download_captchas(user, apikey, domain, ncap, root, cback, shards, index, concurrency, xml_url, saveas):
+    if ncap <= 0: return []
+    concurrency = max(1, min(concurrency, ncap))
+    session = make_session(concurrency)
+    try:
+        if concurrency == 1:
+            return _save_captchas((fetch_captcha(user, apikey, domain, session, xml_url) for _ in range(ncap)), root, cback, shards, index, saveas, ncap)
+        pool = ThreadPoolExecutor(concurrency)
+        try:
+            fetched = _fetch_window(pool, partial(fetch_captcha, user, apikey, domain, session, xml_url), ncap, concurrency * DOWNLOAD_WINDOW)
+            return _save_captchas(fetched, root, cback, shards, index, saveas, ncap)
+        finally:
+            # drop pending downloads if stopped by the callback
+            pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        session.close()
+
+def _fetch_window(pool, fetch, count, window):
+    # yields fetch() results in completion order, keeping at most window downloads submitted at a time
+    # (so that finished images are released as soon as they are saved)
+    pending = set()
+    submitted = 0
+    while submitted < count or pending:
+        while submitted < count and len(pending) < window:
+            pending.add(pool.submit(fetch))
+            submitted += 1
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield fut.result()
+
+def _save_captchas(fetched, root, cback, shards, index, saveas, total=None):
+    # writes downloaded captchas in the calling thread (one by one)
     out_paths = []
-    for i in range(ncap):
-        url = get_sample_captcha(user, apikey, domain)
-        if not url:
-            print_err('Error downloading captcha! No image URL!')
-            continue
+    for i, item in enumerate(fetched):
+        report_progress(i + 1, total)
+        if item is None: continue
+        url, ftype, content = item
         try:
-            res = requests.get(url, proxies=HTTP_PROXIES, timeout=HTTP_TIMEOUT, headers=REQ_HEADERS)
-            if res.status_code != 200:
-                print_err('Error downloading captcha! HTTP Error = {}'.format(res.status_code))
-                continue
-            ftype = res.headers['Content-Type'].split('/')[-1].split(';')[0] if 'Content-Type' in res.headers else 'gif'
-            if not ftype in IMAGE_TYPES:
-                print_err('Wrong image format: ' + ftype)
-                continue
+            chash = content_hash(content)
+            # the same image may be served under different URLs
+            if chash in index: continue
             fname = hashlib.md5(url.encode()).hexdigest() + IMAGE_TYPES[ftype]
-            fpath = os.path.join(root, fname)
-                        
-            with open(fpath, 'wb') as f:
-                f.write(res.content)
+            
+            if shards:
+                shards.append(io.BytesIO(content), meta={'url': url, 'file': fname})
+                fpath = shards.offset + shards.total - 1
+            elif saveas and IMAGE_TYPES[ftype] != IMAGE_TYPES.get(saveas, '.' + saveas):
+                # decode in memory and write the target format only
+                fpath = convert_bytes(content, os.path.join(root, '{}.{}'.format(os.path.splitext(fname)[0], saveas)), saveas)
+                if not fpath: continue
+                ftype = saveas
+            else:
+                fpath = os.path.join(root, fname)
+                with open(fpath, 'wb') as f:
+                    f.write(content)
             #print_dbg('SAVED:\t' + os.path.basename(fname))
             
             if not cback is None:
                 fpath = cback(i, fpath)
-                if not fpath: break
+                if fpath is None or fpath == '': break
             
+            index.add(chash, url, fpath if shards else os.path.basename(fpath), ftype)
             out_paths.append(fpath)           
             
-            
         except Exception as err:
             print_err(str(err))
             continue
         
     return out_paths
-            
-    
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides pluggable executors (serial, process pool, Dask) for batch jobs.
+"""
+
+import os
+import time
+import threading
+import multiprocessing as mp
+
+EXECUTOR_BACKENDS = ('serial', 'process', 'dask')
+EXECUTOR_SHUTDOWN_TIMEOUT = 5   # how long (sec.) shutdown_executors() waits for workers to finish before killing them
+
+# warm executors kept alive between jobs in persistent mode (see set_persistent())
+_PERSISTENT = None
+_PERSISTENT_LOCK = threading.Lock()
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def auto_chunksize(count, workers, chunks_per_worker=4):
+    """
+    Returns a chunk size giving each worker about chunks_per_worker chunks of work.
+    """
+    return max(1, count // (max(1, workers) * chunks_per_worker))
+
+def mp_context():
+    """
+    RETURNS:
+        multiprocessing context to start worker processes with: the default one (fork on Linux)
+        if this is the only thread, otherwise forkserver / spawn. Forking while other threads
+        hold locks (e.g. the main thread's stdin lock inside input() while a background job 
+        starts a pool) leaves these locks held forever in the children, which then hang.
+    """
+    if threading.current_thread() is threading.main_thread() and threading.active_count() == 1:
+        return mp.get_context()
+    return mp.get_context('forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn')
+
+def _run_chunk(func, chunk):
+    return [func(x) for x in chunk]
+
+def _chunked(iterable, chunksize):
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+## ******************************************************************************** ##
+
+class Executor:
+    """
+    Base executor class. Subclasses implement map() which yields the results
+    of func(x) for each x in iterable (in any order).
+    """
+
+    def __init__(self, workers=None, initializer=None, initargs=()):
+        self.workers = workers or cpu_count()
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def map(self, func, iterable, chunksize=1):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        """
+        Stops the workers without waiting for pending jobs.
+        """
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # on errors / job cancellation, drop pending tasks instead of waiting for them
+        if exc_type is None: self.close()
+        else: self.terminate()
+
+class SerialExecutor(Executor):
+    """
+    Runs everything in the current process (useful for debugging and profiling).
+    """
+
+    def __init__(self, workers=None, initializer=None, initargs=()):
+        super().__init__(1, initializer, initargs)
+        if initializer: initializer(*initargs)
+
+    def map(self, func, iterable, chunksize=1):
+        return map(func, iterable)
+
+class ProcessExecutor(Executor):
+    """
+    Runs jobs in a local multiprocessing pool, submitting them in chunks.
+    """
+
+    def __init__(self, workers=None, initializer=None, initargs=()):
+        super().__init__(workers, initializer, initargs)
+        self.pool = mp_context().Pool(self.workers, initializer, initargs)
+
+    def map(self, func, iterable, chunksize=1):
+        return self.pool.imap_unordered(func, iterable, chunksize)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class DaskExecutor(Executor):
+    """
+    Runs jobs on a local Dask distributed cluster, submitting one future per chunk.
+    """
+
+    def __init__(self, workers=None, initializer=None, initargs=()):
+        super().__init__(workers, initializer, initargs)
+        from dask.distributed import Client as DaskClient
+        self.client = DaskClient(n_workers=self.workers, threads_per_worker=1)
+        if initializer: self.client.run(initializer, *initargs)
+
+    def map(self, func, iterable, chunksize=1):
+        from dask.distributed import as_completed
+        futures = [self.client.submit(_run_chunk, func, chunk, pure=False) for chunk in _chunked(iterable, chunksize)]
+        for _, results in as_completed(futures, with_results=True):
+            yield from results
+
+    def close(self):
+        self.client.close()
+
+class PersistentExecutor(Executor):
+    """
+    Shared warm executor returned by get_executor() in persistent mode.
+    Leaving its context doesn't stop the workers, so the next job reuses them
+    (with their initializer already run); if a job failed or was cancelled, 
+    the executor is dropped from the cache (the next job starts new workers) and its workers 
+    are terminated (dropping pending tasks) as soon as no other job is using them.
+    """
+
+    def __init__(self, key, executor):
+        self.key = key
+        self.executor = executor
+        self.workers = executor.workers
+        self.users = 0
+        self.broken = False
+
+    def map(self, func, iterable, chunksize=1):
+        return self.executor.map(func, iterable, chunksize)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        with _PERSISTENT_LOCK:
+            if _PERSISTENT and _PERSISTENT.get(self.key, None) is self: del _PERSISTENT[self.key]
+        self.executor.terminate()
+
+    def __enter__(self):
+        with _PERSISTENT_LOCK:
+            self.users += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with _PERSISTENT_LOCK:
+            self.users -= 1
+            if not exc_type is None:
+                self.broken = True
+                if _PERSISTENT and _PERSISTENT.get(self.key, None) is self: del _PERSISTENT[self.key]
+            stop = self.broken and self.users == 0
+        if stop: self.executor.terminate()
+
+def _make_executor(backend, workers, initializer, initargs):
+    if backend == 'serial':
+        return SerialExecutor(workers, initializer, initargs)
+    if backend == 'process':
+        return ProcessExecutor(workers, initializer, initargs)
+    if backend == 'dask':
+        return DaskExecutor(workers, initializer, initargs)
+    raise Exception('Unknown executor backend "{}", must be one of: {}'.format(backend, ', '.join(EXECUTOR_BACKENDS)))
+
+def get_executor(backend='process', workers=None, initializer=None, initargs=()):
+    """
+    Creates an executor (or returns a warm one in persistent mode, see set_persistent()).
+    PARAMS:
+        - backend [str]: one of EXECUTOR_BACKENDS ('serial', 'process', 'dask')
+        - workers [int]: number of worker processes (None = number of available cores)
+        - initializer [callable]: OPTIONAL: function called once in each worker on start
+        - initargs [tuple]: arguments passed to initializer
+    RETURNS:
+        Executor instance (use as a context manager to release workers)
+    """
+    if _PERSISTENT is None or backend == 'serial':
+        return _make_executor(backend, workers, initializer, initargs)
+    key = (backend, workers or cpu_count(), initializer, tuple(initargs))
+    with _PERSISTENT_LOCK:
+        if _PERSISTENT is None: 
+            return _make_executor(backend, workers, initializer, initargs)
+        if not key in _PERSISTENT:
+            _PERSISTENT[key] = PersistentExecutor(key, _make_executor(backend, workers, initializer, initargs))
+        return _PERSISTENT[key]
+
+def set_persistent(enabled=True):
+    """
+    Turns the persistent mode on or off. In persistent mode, get_executor() keeps one warm executor
+    per (backend, workers, initializer, initargs) alive across calls until shutdown_executors() 
+    (e.g. for the whole interactive CLI session). Turning it off shuts the warm executors down.
+    """
+    global _PERSISTENT
+    if enabled:
+        with _PERSISTENT_LOCK:
+            if _PERSISTENT is None: _PERSISTENT = {}
+    else:
+        shutdown_executors()
+        _PERSISTENT = None
+
+def shutdown_executors(timeout=EXECUTOR_SHUTDOWN_TIMEOUT):
+    """
+    Stops all warm executors (persistent mode stays on), waiting up to timeout seconds
+    for their workers to finish and terminating the ones still running after that.
+    """
+    with _PERSISTENT_LOCK:
+        executors = list(_PERSISTENT.values()) if _PERSISTENT else []
+        if _PERSISTENT: _PERSISTENT.clear()
+    deadline = time.monotonic() + timeout
+    for executor in executors:
+        closer = threading.Thread(target=executor.executor.close, daemon=True)
+        closer.start()
+        closer.join(max(0.0, deadline - time.monotonic()))
+        if closer.is_alive(): executor.executor.terminate()
@@ -38,5 +38,9 @@ if COLORED_OUTPUT and not COLOR_INITIATED:
 IPSERVICES = ['https://api.ipify.org', 'https://ident.me', 'https://ipecho.net/plain', 'https://myexternalip.com/raw']
 HTTP_PROXIES = None # or dict, e.g. {'http': 'http://ip:port', 'https': 'http://ip:port'}
 HTTP_TIMEOUT = 5                 # ожидание соединения и ответа (сек.) None = вечно
+HTTP_RETRIES = 3                 # number of retries on connection errors / HTTP 5xx and 429
+HTTP_BACKOFF = 0.5               # initial retry delay (sec.), doubled after each retry
+IP_CACHE_TTL = 600               # how long (sec.) the resolved external IP is reused
 
-IMG_DIRECTORY = 'imgset/original'
\ No newline at end of file
+IMG_DIRECTORY = 'imgset/original'
+IMG_SHAPE = (60, 200)               # (height, width) of images packed into dataset shards
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides background jobs for the interactive CLI.
+A job runs a command in its own thread. Long-running functions report their progress with
+    report_progress(done, total)
+which is a no-op outside of jobs and raises JobCancelled once the job has been cancelled
+(so cancellation takes effect at the next progress report).
+"""
+
+import time
+import threading
+
+_LOCAL = threading.local()
+
+class JobCancelled(BaseException):
+    # derived from BaseException, so that generic 'except Exception' handlers don't swallow it
+    pass
+
+def current_job():
+    """
+    RETURNS:
+        the Job running in the current thread or None
+    """
+    return getattr(_LOCAL, 'job', None)
+
+def report_progress(done, total=None):
+    """
+    Reports the progress of the current job (if any).
+    PARAMS:
+        - done [int]: number of processed items
+        - total [int]: OPTIONAL: total number of items
+    """
+    job = getattr(_LOCAL, 'job', None)
+    if job is None: return
+    job.done = done
+    if not total is None: job.total = total
+    if job.cancelled.is_set(): raise JobCancelled()
+
+## ******************************************************************************** ##
+
+class Job:
+    """
+    Command running in a background thread.
+    Status: 'running', 'done', 'failed' or 'cancelled'.
+    """
+
+    def __init__(self, job_id, name, func, on_finish=None):
+        self.id = job_id
+        self.name = name
+        self.func = func
+        self.on_finish = on_finish
+        self.status = 'running'
+        self.result = None
+        self.error = None
+        self.done = 0
+        self.total = None
+        self.started = None
+        self.finished = None
+        self.cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='job-{}'.format(job_id), daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        _LOCAL.job = self
+        try:
+            self.result = self.func()
+            self.status = 'done'
+        except JobCancelled:
+            self.status = 'cancelled'
+        except Exception as err:
+            self.error = str(err)
+            self.status = 'failed'
+        finally:
+            _LOCAL.job = None
+            self.finished = time.time()
+            if self.on_finish: self.on_finish(self)
+
+    def cancel(self):
+        """
+        Requests cancellation (the job stops at its next progress report).
+        """
+        self.cancelled.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started if self.started else 0.0
+
+    def progress(self):
+        """
+        RETURNS:
+            progress text, e.g. '150/1000 (15%)'
+        """
+        if self.total: return '{}/{} ({:.0f}%)'.format(self.done, self.total, 100.0 * self.done / self.total)
+        return str(self.done)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a persistent (SQLite) store of captcha labels keyed by image file hash
+and the import of labels typed into the spreadsheets made by xls.images_to_excel().
+"""
+
+import os
+import glob
+import time
+import sqlite3
+from .dlindex import content_hash
+
+LABELS_FILE = 'labels.sqlite'
+LABEL_COLUMN = 3                # spreadsheet column with the typed labels (C, next to the images in B)
+PATH_COLUMN = 1                 # spreadsheet column with the image paths (A)
+IMPORT_BATCH = 1000             # records inserted per transaction
+
+def file_hash(filepath):
+    with open(filepath, 'rb') as f:
+        return content_hash(f.read())
+
+def normalize_label(value, chars, length):
+    """
+    Converts a spreadsheet cell value to a label string.
+    Numbers are zero-padded to the label length (Excel drops leading zeros of numeric cells).
+    RETURNS:
+        label string or None if the value isn't a valid label
+    """
+    if value is None: return None
+    if isinstance(value, float) and value.is_integer(): value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool): value = str(value).zfill(length)
+    label = str(value).strip().replace(' ', '')
+    if len(label) != length or any(not c in chars for c in label): return None
+    return label
+
+## ******************************************************************************** ##
+
+class LabelStore:
+    """
+    Label store in LABELS_FILE in the given directory.
+    Each record holds: image file hash (primary key), label, file path at import time.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(os.path.abspath(directory), LABELS_FILE)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS labels (hash TEXT PRIMARY KEY, label TEXT NOT NULL, '
+                          'file TEXT, added REAL) WITHOUT ROWID')
+        self.conn.commit()
+
+    def __contains__(self, hash_):
+        return not self.conn.execute('SELECT 1 FROM labels WHERE hash = ?', (hash_,)).fetchone() is None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM labels').fetchone()[0]
+
+    def get(self, hash_, default=None):
+        """
+        RETURNS:
+            label for the image content hash or default
+        """
+        row = self.conn.execute('SELECT label FROM labels WHERE hash = ?', (hash_,)).fetchone()
+        return default if row is None else row[0]
+
+    def get_file(self, filepath, default=None):
+        """
+        RETURNS:
+            label for the image file (looked up by its content, so renamed / moved files are found) or default
+        """
+        return self.get(file_hash(filepath), default)
+
+    def put_many(self, records):
+        """
+        Adds or replaces records in one transaction.
+        PARAMS:
+            - records [iterable]: tuples (hash, label, file path)
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO labels (hash, label, file, added) VALUES (?, ?, ?, ?)',
+                                  ((h, label, str(f), now) for h, label, f in records))
+
+    def items(self):
+        """
+        Iterates over (hash, label) pairs.
+        """
+        yield from self.conn.execute('SELECT hash, label FROM labels')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+## ******************************************************************************** ##
+
+def workbook_parts(xlsfile):
+    """
+    RETURNS:
+        list of the workbook and its split parts ('table.xlsx', 'table_002.xlsx', ...) that exist
+    """
+    base, ext = os.path.splitext(xlsfile)
+    parts = sorted(glob.glob('{}_[0-9][0-9][0-9]{}'.format(glob.escape(base), ext)))
+    return ([xlsfile] if os.path.isfile(xlsfile) else []) + parts
+
+def _resolve_image(path, imgdir):
+    if os.path.isfile(path): return path
+    # the workbook may have been made on another machine / before moving the images
+    if imgdir:
+        moved = os.path.join(imgdir, os.path.basename(path.replace('\\', '/')))
+        if os.path.isfile(moved): return moved
+    return None
+
+def import_labels(xlsfiles, store_dir, chars, length, imgdir=None, label_col=LABEL_COLUMN, path_col=PATH_COLUMN):
+    """
+    Reads image paths and typed labels from labeling workbooks (streaming, read-only)
+    and saves valid labels to the LabelStore in store_dir, keyed by image file hash.
+    PARAMS:
+        - xlsfiles [str or list]: workbook path(s); split parts of each workbook are read too
+        - store_dir [str]: label store directory
+        - chars [str]: allowed label characters
+        - length [int]: label length
+        - imgdir [str]: OPTIONAL: directory to look for images whose saved paths don't exist
+        - label_col, path_col [int]: 1-based columns of labels and image paths
+    RETURNS:
+        dict: imported count, empty rows count, list of invalid (workbook, sheet, row, value),
+        list of missing (workbook, sheet, row, path)
+    """
+    import openpyxl
+
+    if isinstance(xlsfiles, str): xlsfiles = [xlsfiles]
+    stats = {'imported': 0, 'empty': 0, 'invalid': [], 'missing': []}
+    ncols = max(label_col, path_col)
+    with LabelStore(store_dir) as store:
+        batch = []
+        for xlsfile in (part for f in xlsfiles for part in workbook_parts(f)):
+            wb = openpyxl.load_workbook(xlsfile, read_only=True, data_only=True)
+            try:
+                for ws in wb.worksheets:
+                    for nrow, values in enumerate(ws.iter_rows(max_col=ncols, values_only=True), 1):
+                        values = values + (None,) * (ncols - len(values))
+                        path, value = values[path_col - 1], values[label_col - 1]
+                        if not path: continue
+                        if value is None or str(value).strip() == '':
+                            stats['empty'] += 1
+                            continue
+                        label = normalize_label(value, chars, length)
+                        if label is None:
+                            stats['invalid'].append((xlsfile, ws.title, nrow, value))
+                            continue
+                        imgfile = _resolve_image(str(path), imgdir)
+                        if imgfile is None:
+                            stats['missing'].append((xlsfile, ws.title, nrow, path))
+                            continue
+                        batch.append((file_hash(imgfile), label, imgfile))
+                        if len(batch) >= IMPORT_BATCH:
+                            store.put_many(batch)
+                            stats['imported'] += len(batch)
+                            batch = []
+            finally:
+                wb.close()
+        store.put_many(batch)
+        stats['imported'] += len(batch)
+    return stats
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a cached manifest of image directories.
+The manifest records each file's (path, size, mtime, label) along with the mtime of its directory. 
+A directory's mtime changes whenever files are added, removed or renamed in it, so on repeat scans
+directories with an unchanged mtime are taken from the manifest without listing them.
+Manifests are kept in MANIFEST_DIR (one per scanned root directory), so saving them never
+changes the mtime of the scanned directories and works for read-only directories too.
+(Files overwritten in place don't change their directory's mtime, so their recorded
+size and mtime may be stale: delete the manifest (see manifest_path()) to force a full rescan.)
+"""
+
+import os
+import json
+import hashlib
+
+MANIFEST_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', None) or os.path.join(os.path.expanduser('~'), '.cache'), 
+                            'ycaptcha', 'manifests')
+MANIFEST_VERSION = 1
+LABEL_SEPARATOR = '__'          # labeled files are named like '<label>__<anything>.<ext>' (see capprocess.synth_captcha())
+
+def label_from_name(filename):
+    """
+    RETURNS:
+        the label encoded in the file name or empty string
+    """
+    label, sep, _ = filename.partition(LABEL_SEPARATOR)
+    return label if sep else ''
+
+def _scan_dir(path):
+    """
+    RETURNS:
+        tuple (subdirectory names, file entries [name, size, mtime, label])
+    """
+    dirs, files = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif entry.is_file():
+                st = entry.stat()
+                files.append([entry.name, st.st_size, st.st_mtime, label_from_name(entry.name)])
+    return dirs, files
+
+def manifest_path(root_path):
+    """
+    RETURNS:
+        path of the manifest file of the root directory (in MANIFEST_DIR)
+    """
+    root_path = os.path.abspath(root_path)
+    return os.path.join(MANIFEST_DIR, hashlib.sha1(root_path.encode('utf-8')).hexdigest() + '.json')
+
+def load_manifest(root_path):
+    try:
+        with open(manifest_path(root_path), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version', None) == MANIFEST_VERSION and manifest.get('root', None) == os.path.abspath(root_path):
+            return manifest['dirs']
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save_manifest(root_path, dirs):
+    """
+    RETURNS:
+        True if saved, False on error (the manifest is only a cache, so errors aren't fatal)
+    """
+    filename = manifest_path(root_path)
+    try:
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        # write to a temp file first, so that an interrupted save doesn't corrupt the manifest
+        tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmpname, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'root': os.path.abspath(root_path), 'dirs': dirs}, f, separators=(',', ':'))
+        os.replace(tmpname, filename)
+        return True
+    except OSError:
+        return False
+
+def scan_manifest(root_path, recurse=False, file_types=None, save=True):
+    """
+    Lists files using (and updating) the manifest of root_path kept in MANIFEST_DIR (see manifest_path()).
+    PARAMS:
+        - root_path [str]: root directory
+        - recurse [bool]: include subdirectories
+        - file_types [iterable]: OPTIONAL: file extensions to return (None = all)
+        - save [bool]: save the updated manifest
+    RETURNS:
+        list of tuples (path, size, mtime, label)
+    """
+    root_path = os.path.abspath(root_path)
+    old = load_manifest(root_path)
+    new = {}
+    result = []
+    exts = None if not file_types else tuple('.' + ext.lower() for ext in file_types)
+    stack = ['.']
+    while stack:
+        rel = stack.pop()
+        path = os.path.normpath(os.path.join(root_path, rel))
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        cached = old.get(rel, None)
+        if cached is None or cached['mtime'] != mtime:
+            try:
+                dirs, files = _scan_dir(path)
+            except OSError:
+                continue
+            cached = {'mtime': mtime, 'dirs': dirs, 'files': files}
+        new[rel] = cached
+        for name, size, fmtime, label in cached['files']:
+            if exts is None or name.lower().endswith(exts):
+                result.append((os.path.join(path, name), size, fmtime, label))
+        if recurse:
+            stack.extend(os.path.join(rel, d) if rel != '.' else d for d in reversed(cached['dirs']))
+    if save and new != old:
+        # keep cached subdirectories that weren't visited in this scan (recurse=False)
+        for rel, cached in old.items():
+            new.setdefault(rel, cached)
+        if new != old: save_manifest(root_path, new)
+    return result
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a producer / consumer pipeline of concurrent stages linked by bounded queues:
+a stage blocks when the next one falls behind (backpressure), so memory use stays flat
+however many items pass through. Each stage runs its function in its own worker threads,
+except the last one, which runs in the calling thread (so it can use thread-bound resources
+like SQLite connections or workbooks). Per-stage counters show where the bottleneck is.
+
+download_pipeline() links the captcha download (network-bound), conversion (CPU-bound)
+and Excel export stages this way.
+"""
+
+import os
+import time
+import queue
+import hashlib
+import threading
+from collections import deque
+from .utils import *
+from .download import fetch_captcha, make_session, IMAGE_TYPES, SAMPLE_CAPTCHA_URL
+from .dlindex import DownloadIndex, content_hash
+from .xls import ExcelImageWriter
+
+PIPE_QUEUE_SIZE = 16            # max items waiting between two stages
+PIPE_POLL = 0.1                 # how often (sec.) blocked workers check if the pipeline was stopped
+PIPE_LATENCY_WINDOW = 10000     # number of recent end-to-end item latencies kept
+
+_END = object()                 # end-of-stream marker
+
+class Stage:
+    """
+    Pipeline stage calling func(item) for each item in the given number of worker threads.
+    func returns the item passed to the next stage; None drops the item.
+    Errors are counted and printed, and the item is dropped.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.processed = 0          # items passed to func
+        self.emitted = 0            # items passed on
+        self.failed = 0             # items func raised on
+        self.busy = 0.0             # total time (sec.) spent in func
+        self.starved = 0.0          # total time waiting for input (= upstream is slower)
+        self.blocked = 0.0          # total time waiting for room in the output queue (= downstream is slower)
+
+    def process(self, item):
+        """
+        RETURNS:
+            func(item) or None if it failed
+        """
+        t = time.perf_counter()
+        try:
+            res = self.func(item)
+            failed = 0
+        except Exception as err:
+            print_err('{}: {}'.format(self.name, err))
+            res = None
+            failed = 1
+        busy = time.perf_counter() - t
+        with self.lock:
+            self.processed += 1
+            self.failed += failed
+            self.busy += busy
+            if not res is None: self.emitted += 1
+        return res
+
+    def stats(self, elapsed):
+        """
+        RETURNS:
+            dict: item counts, throughput (items/sec of the whole run), time per item [ms],
+            utilization (fraction of worker time spent in func) and starved / blocked time fractions
+        """
+        worker_time = elapsed * self.workers or 1.0
+        return {'name': self.name, 'workers': self.workers, 'processed': self.processed, 'emitted': self.emitted,
+                'failed': self.failed, 'per_sec': self.processed / elapsed if elapsed else 0.0,
+                'ms_per_item': self.busy * 1000.0 / self.processed if self.processed else 0.0,
+                'utilization': self.busy / worker_time, 'starved': self.starved / worker_time,
+                'blocked': self.blocked / worker_time}
+
+## ******************************************************************************** ##
+
+class Pipeline:
+    """
+    Chain of stages linked by bounded queues.
+    Use like so:
+        pipe = Pipeline([Stage('fetch', fetch, 8), Stage('decode', decode, 2), Stage('save', save)])
+        results = pipe.run(urls)
+        print(format_stats(pipe.stats()))
+    """
+
+    def __init__(self, stages, queue_size=PIPE_QUEUE_SIZE):
+        if not stages: raise Exception('Pipeline needs at least one stage')
+        self.stages = stages
+        self.queue_size = queue_size
+        self.elapsed = 0.0
+        # end-to-end latencies (sec.) of recent items, from being taken by the first stage to leaving the last one
+        self.latencies = deque(maxlen=PIPE_LATENCY_WINDOW)
+        self._stop = threading.Event()
+
+    def _put(self, q, item, stage=None):
+        # blocks while the queue is full, unless the pipeline is stopped
+        t = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=PIPE_POLL)
+                break
+            except queue.Full:
+                pass
+        if stage:
+            with stage.lock: stage.blocked += time.perf_counter() - t
+        return not self._stop.is_set()
+
+    def _get(self, q, stage):
+        # RETURNS: next item, _END at the end of the stream or if the pipeline is stopped
+        t = time.perf_counter()
+        item = _END
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=PIPE_POLL)
+                break
+            except queue.Empty:
+                pass
+        with stage.lock: stage.starved += time.perf_counter() - t
+        return item
+
+    def _feed(self, source, outq):
+        try:
+            for item in source:
+                # items travel with the time the first stage took them (set by _work())
+                if not self._put(outq, (None, item)): return
+        except Exception as err:
+            print_err('source: {}'.format(err))
+        self._put(outq, _END)
+
+    def _work(self, stage, inq, outq, running):
+        while True:
+            entry = self._get(inq, stage)
+            if entry is _END:
+                # let the other workers of this stage see the end too
+                self._put(inq, _END)
+                break
+            started = entry[0] or time.perf_counter()
+            res = stage.process(entry[1])
+            if not res is None and not self._put(outq, (started, res), stage): break
+        with stage.lock:
+            running[0] -= 1
+            last = running[0] == 0
+        if last: self._put(outq, _END)
+
+    def run(self, source, total=None):
+        """
+        Passes the items from source through all the stages.
+        PARAMS:
+            - source [iterable]: input items (consumed lazily in a feeder thread)
+            - total [int]: OPTIONAL: number of source items (for progress reports, see jobs.report_progress())
+        RETURNS:
+            list of the last stage's results (in completion order)
+        """
+        self._stop.clear()
+        for stage in self.stages: stage.reset()
+        self.latencies.clear()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0]), daemon=True)]
+        for stage, inq, outq in zip(self.stages[:-1], queues, queues[1:]):
+            running = [stage.workers]
+            threads.extend(threading.Thread(target=self._work, args=(stage, inq, outq, running), daemon=True)
+                           for _ in range(stage.workers))
+        last = self.stages[-1]
+        results = []
+        t = time.perf_counter()
+        try:
+            for thread in threads: thread.start()
+            while True:
+                entry = self._get(queues[-1], last)
+                if entry is _END: break
+                started = entry[0] or time.perf_counter()
+                res = last.process(entry[1])
+                if not res is None: 
+                    results.append(res)
+                    self.latencies.append(time.perf_counter() - started)
+                report_progress(last.processed, total)
+        finally:
+            # on errors / cancellation, unblock and stop all workers
+            self._stop.set()
+            for thread in threads: thread.join()
+            self.elapsed = time.perf_counter() - t
+        return results
+
+    def stats(self):
+        """
+        RETURNS:
+            list of stage stats (see Stage.stats()) from the last run
+        """
+        return [stage.stats(self.elapsed) for stage in self.stages]
+
+def format_stats(stats):
+    """
+    RETURNS:
+        stage stats as a text table, marking the busiest stage (the bottleneck)
+    """
+    bottleneck = max(stats, key=lambda s: s['utilization'])['name'] if stats else None
+    lines = ['{:<10}{:>8}{:>10}{:>8}{:>10}{:>10}{:>8}{:>9}{:>9}'.format('stage', 'workers', 'items', 'failed', 'items/s',
+                                                                       'ms/item', 'busy', 'starved', 'blocked')]
+    for s in stats:
+        lines.append('{name:<10}{workers:>8}{processed:>10}{failed:>8}{per_sec:>10.1f}{ms_per_item:>10.2f}{utilization:>8.0%}'
+                     '{starved:>9.0%}{blocked:>9.0%}'.format(**s) + ('  <- bottleneck' if s['name'] == bottleneck else ''))
+    return '\n'.join(lines)
+
+## ******************************************************************************** ##
+
+def download_pipeline(user, apikey, domain='com', ncap=1, directory=None, xlsfile=None, saveas='jpg', fetchers=8,
+                      converters=2, queue_size=PIPE_QUEUE_SIZE, split_rows=None, xml_url=SAMPLE_CAPTCHA_URL, stats=None, 
+                      latencies=None):
+    """
+    Downloads captchas, converts them and exports them to Excel in one pass, with the three stages running concurrently:
+        fetch (fetchers threads):       XML query + image download over keep-alive connections
+        convert (converters threads):   decoding and saving in the saveas format
+        export (calling thread):        duplicate check + download index record + Excel row (see xls.ExcelImageWriter)
+    At most about fetchers + converters + 2 * queue_size images are held in memory at any time.
+    PARAMS:
+        - user, apikey, domain, ncap, directory, xml_url: see download.download_sample_captchas()
+        - xlsfile [str]: OPTIONAL: output workbook (default = 'table.xlsx' in the save directory; empty = don't export)
+        - saveas [str]: image format to save (e.g. 'jpg'); None / empty = save as downloaded
+        - fetchers [int]: number of parallel downloads
+        - converters [int]: number of converting threads (decoding / encoding runs mostly outside the GIL)
+        - queue_size [int]: max images waiting between two stages
+        - split_rows [int]: OPTIONAL: max images per workbook (see xls.images_to_excel())
+        - stats [list]: OPTIONAL: list to put the stage stats into (see format_stats())
+        - latencies [list]: OPTIONAL: list to put the end-to-end latencies (sec.) of recent images into
+    RETURNS:
+        tuple (list of saved file paths, list of written workbooks)
+    """
+    root = directory if not directory is None else os.path.abspath(IMG_DIRECTORY)
+    os.makedirs(root, exist_ok=True)
+    if xlsfile is None: xlsfile = os.path.join(root, 'table.xlsx')
+    fetchers = max(1, min(fetchers, ncap))
+    index = DownloadIndex(root)
+    session = make_session(fetchers)
+    writer = ExcelImageWriter(xlsfile, split_rows) if xlsfile else None
+
+    def fetch(_):
+        return fetch_captcha(user, apikey, domain, session, xml_url)
+
+    def convert(item):
+        url, ftype, content = item
+        chash = content_hash(content)
+        fname = hashlib.md5(url.encode()).hexdigest() + IMAGE_TYPES[ftype]
+        if saveas and IMAGE_TYPES[ftype] != IMAGE_TYPES.get(saveas, '.' + saveas):
+            fpath = convert_bytes(content, os.path.join(root, '{}.{}'.format(os.path.splitext(fname)[0], saveas)), saveas)
+            if not fpath: return None
+            ftype = saveas
+        else:
+            fpath = os.path.join(root, fname)
+            with open(fpath, 'wb') as f:
+                f.write(content)
+        return chash, url, fpath, ftype
+
+    def export(item):
+        chash, url, fpath, ftype = item
+        fname = os.path.basename(fpath)
+        if not index.add(chash, url, fname, ftype):
+            # the same image may be served under different URLs: drop the new copy (unless it is the indexed file)
+            if index.get(chash)['file'] != fname: os.remove(fpath)
+            return None
+        if writer: writer.write(fpath)
+        return fpath
+
+    pipe = Pipeline([Stage('fetch', fetch, fetchers), Stage('convert', convert, converters), Stage('export', export)], queue_size)
+    try:
+        files = pipe.run(range(max(0, ncap)), ncap)
+    finally:
+        session.close()
+        index.close()
+        books = writer.close() if writer else []
+        if not stats is None: stats.extend(pipe.stats())
+        if not latencies is None: latencies.extend(pipe.latencies)
+    return files, books
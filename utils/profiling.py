@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides opt-in per-stage timing instrumentation.
+Code marks its stages like so:
+    with stage('curves'):
+        ...
+When profiling is disabled (default), stage() returns a shared no-op context manager.
+"""
+
+import time
+import json
+import cProfile
+from contextlib import nullcontext
+
+_NULL_STAGE = nullcontext()
+_PROFILER = None
+
+class _StageTimer:
+
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        rec = self.stats.get(self.name, None)
+        if rec is None:
+            rec = self.stats[self.name] = [0.0, 0]
+        rec[0] += time.perf_counter() - self.start
+        rec[1] += 1
+
+## ******************************************************************************** ##
+
+class StageProfiler:
+    """
+    Accumulates total time and call count per stage name.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def stage(self, name):
+        return _StageTimer(self.stats, name)
+
+    def reset(self):
+        self.stats = {}
+
+    def snapshot(self):
+        return {name: list(rec) for name, rec in self.stats.items()}
+
+    def merge(self, stats):
+        """
+        Adds stats (e.g. a snapshot() from a worker process) to this profiler's stats.
+        """
+        for name, (sec, calls) in stats.items():
+            rec = self.stats.setdefault(name, [0.0, 0])
+            rec[0] += sec
+            rec[1] += calls
+
+    def summary(self):
+        """
+        RETURNS:
+            text table of stages sorted by total time
+        """
+        total = sum(rec[0] for rec in self.stats.values()) or 1.0
+        lines = ['{:<16} {:>10} {:>10} {:>12} {:>7}'.format('STAGE', 'CALLS', 'TOTAL, s', 'PER CALL, ms', '%')]
+        for name, (sec, calls) in sorted(self.stats.items(), key=lambda x: -x[1][0]):
+            lines.append('{:<16} {:>10} {:>10.3f} {:>12.3f} {:>7.1f}'.format(name, calls, sec, 1000.0 * sec / max(calls, 1), 100.0 * sec / total))
+        return '\n'.join(lines)
+
+    def dump(self, filename, root='synth_captcha'):
+        """
+        Saves the stats: as JSON if filename ends with '.json', otherwise in the folded-stacks
+        format (one "root;stage microseconds" line per stage) read by flamegraph.pl / speedscope.
+        """
+        with open(filename, 'w', encoding='utf-8') as f:
+            if filename.lower().endswith('.json'):
+                json.dump(self.stats, f, indent=2)
+            else:
+                for name, (sec, calls) in self.stats.items():
+                    f.write('{};{} {}\n'.format(root, name, int(sec * 1e6)))
+
+def stage(name):
+    """
+    Returns a context manager timing the named stage (a no-op if profiling is disabled).
+    """
+    return _NULL_STAGE if _PROFILER is None else _PROFILER.stage(name)
+
+def enable_profiling():
+    global _PROFILER
+    if _PROFILER is None: _PROFILER = StageProfiler()
+    return _PROFILER
+
+def disable_profiling():
+    global _PROFILER
+    _PROFILER = None
+
+def get_profiler():
+    """
+    RETURNS:
+        the active StageProfiler or None if profiling is disabled
+    """
+    return _PROFILER
+
+def profiled_call(func, *args, **kwargs):
+    """
+    Calls func with stage profiling enabled just for this call (e.g. in worker processes).
+    RETURNS:
+        tuple (func result, stage stats snapshot of this call)
+    """
+    global _PROFILER
+    previous = _PROFILER
+    _PROFILER = profiler = StageProfiler()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        _PROFILER = previous
+    return result, profiler.snapshot()
+
+def cprofile_call(filename, func, *args, **kwargs):
+    """
+    Runs func under cProfile and saves the stats to filename
+    (viewable with pstats, snakeviz or converted to a flamegraph with flameprof).
+    RETURNS:
+        func result
+    """
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        prof.dump_stats(filename)
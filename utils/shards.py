@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2019, Iskander Shafikov <s00mbre@gmail.com>
+# GNU General Public License v3.0+ (see LICENSE or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""
+This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
+
+This module provides a sharded binary dataset format: fixed-size grayscale images
+packed into .npy shards, each with a JSON sidecar holding the labels and metadata.
+Layout of a dataset directory:
+    shard_00000.npy     uint8 array (count, height, width)
+    shard_00000.json    {"count": count, "shape": [height, width], "labels": [...], "meta": [...]}
+    shard_00001.npy
+    ...
+"""
+
+import os
+import glob
+import json
+import numpy as np
+from PIL import Image
+
+SHARD_PREFIX = 'shard_'
+SHARD_SIZE = 10000
+
+def to_gray_array(img, shape):
+    """
+    Converts an image (PIL Image, ndarray or file path / file object) to a uint8 grayscale array
+    of the given (height, width) shape, resizing it if needed.
+    """
+    if isinstance(img, np.ndarray) and img.shape == tuple(shape) and img.dtype == np.uint8:
+        return img
+    if not isinstance(img, Image.Image):
+        img = Image.fromarray(img) if isinstance(img, np.ndarray) else Image.open(img)
+    if img.mode != 'L': img = img.convert('L')
+    if img.size != (shape[1], shape[0]): img = img.resize((shape[1], shape[0]), Image.BILINEAR)
+    return np.asarray(img, dtype=np.uint8)
+
+def shard_files(directory):
+    return sorted(glob.glob(os.path.join(directory, SHARD_PREFIX + '*.npy')))
+
+def read_shard_index(npy_path):
+    """
+    Returns the sidecar index dict of the given shard or None if the shard is incomplete.
+    """
+    json_path = os.path.splitext(npy_path)[0] + '.json'
+    if not os.path.isfile(json_path): return None
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+## ******************************************************************************** ##
+
+class ShardWriter:
+    """
+    Appends images with labels to a sharded dataset directory.
+    New shards are numbered after any existing ones, so a directory can be appended to.
+    Use as a context manager (or call close()) to write the last shard's index.
+    """
+
+    def __init__(self, directory, shape=(60, 200), shard_size=SHARD_SIZE):
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory): os.makedirs(self.directory)
+        self.shape = tuple(shape)
+        self.shard_size = shard_size
+        existing = shard_files(self.directory)
+        self.shard_num = len(existing)
+        # number of images already in the dataset (global index of the first appended image)
+        self.offset = sum(index['count'] for index in map(read_shard_index, existing) if index)
+        self.total = 0
+        self._data = None
+        self._labels = []
+        self._meta = []
+
+    def _shard_path(self, ext):
+        return os.path.join(self.directory, '{}{:05d}{}'.format(SHARD_PREFIX, self.shard_num, ext))
+
+    def append(self, img, label='', meta=None):
+        """
+        Adds an image (see to_gray_array()) with its label and optional metadata dict.
+        """
+        if self._data is None:
+            self._data = np.lib.format.open_memmap(self._shard_path('.npy'), mode='w+', dtype=np.uint8,
+                                                   shape=(self.shard_size,) + self.shape)
+        self._data[len(self._labels)] = to_gray_array(img, self.shape)
+        self._labels.append(label)
+        self._meta.append(meta or {})
+        self.total += 1
+        if len(self._labels) >= self.shard_size: self.flush()
+
+    def flush(self):
+        """
+        Closes the current shard (trimming it to the actual count) and writes its index.
+        """
+        if self._data is None: return
+        count = len(self._labels)
+        npy_path = self._shard_path('.npy')
+        tmp_path = npy_path + '.tmp'
+        if count < self.shard_size:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, self._data[:count])
+        self._data.flush()
+        # release the memory map before replacing the file
+        self._data = None
+        if count < self.shard_size: os.replace(tmp_path, npy_path)
+        with open(self._shard_path('.json'), 'w', encoding='utf-8') as f:
+            json.dump({'count': count, 'shape': list(self.shape), 'labels': self._labels, 'meta': self._meta}, f)
+        self._labels = []
+        self._meta = []
+        self.shard_num += 1
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ShardReader:
+    """
+    Random-access reader of a sharded dataset. Shards are memory-mapped,
+    so reader[i] returns a zero-copy (read-only) view of the i-th image.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.shards = []
+        self.labels = []
+        self.meta = []
+        counts = []
+        for npy_path in shard_files(self.directory):
+            index = read_shard_index(npy_path)
+            # shards without an index are incomplete (writer not closed)
+            if index is None: continue
+            self.shards.append(np.load(npy_path, mmap_mode='r'))
+            self.labels.extend(index['labels'])
+            self.meta.extend(index['meta'])
+            counts.append(index['count'])
+        self.offsets = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def locate(self, i):
+        """
+        Returns the (shard number, position in shard) pair for the global index i.
+        """
+        if i < 0: i += len(self)
+        if i < 0 or i >= len(self): raise IndexError('Index {} out of range'.format(i))
+        shard = int(np.searchsorted(self.offsets, i, side='right')) - 1
+        return shard, i - int(self.offsets[shard])
+
+    def __getitem__(self, i):
+        shard, pos = self.locate(i)
+        return self.shards[shard][pos], self.labels[i]
+
+    def __iter__(self):
+        i = 0
+        for data in self.shards:
+            for img in data:
+                yield img, self.labels[i]
+                i += 1
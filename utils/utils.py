@@ -7,10 +7,17 @@ This file is part of the ycaptcha project hosted at https://github.com/S0mbre/yc
 
 import sys
 import os
-import requests
-from PIL import Image
+import io
+import time
+import threading
+from functools import partial
 from .globalvars import *
+from .executors import get_executor, auto_chunksize
+from .manifest import scan_manifest
+from .jobs import report_progress
 
+_IP_CACHE = {'ip': None, 'time': 0.0}
+_IP_LOCK = threading.Lock()
 
 def print_err(what, file=sys.stderr):
     print(COLOR_ERR + what, file=file)
@@ -21,10 +28,28 @@ def print_dbg(what, file=sys.stdout):
 def print_help(what, file=sys.stdout):
     print(COLOR_HELP + what, file=file)
     
-def get_ip():
+def get_ip(ttl=IP_CACHE_TTL):
     """
     Вернуть текущий внешний IP хоста.
+    The result is cached for ttl seconds (0 = always resolve).
     """
+    with _IP_LOCK:
+        if _IP_CACHE['ip'] is None or time.monotonic() - _IP_CACHE['time'] > ttl:
+            _IP_CACHE['ip'] = _resolve_ip()
+            _IP_CACHE['time'] = time.monotonic()
+        return _IP_CACHE['ip']
+
+def set_ip(ip):
+    """
+    Pins the external IP returned by get_ip() (e.g. for local test servers), so it's never resolved.
+    """
+    with _IP_LOCK:
+        _IP_CACHE['ip'] = ip
+        _IP_CACHE['time'] = float('inf')
+
+def _resolve_ip():
+    # requests and PIL are imported where they are used, to keep CLI startup fast
+    import requests
     for service in IPSERVICES:
         try:
             return requests.get(service, proxies=HTTP_PROXIES, timeout=HTTP_TIMEOUT).text
@@ -32,18 +57,50 @@ def get_ip():
             pass
     return ''
 
-def walk_dir(root_path, recurse, file_types, file_process_function):
+def iter_files(root_path, recurse=False, file_types=None, manifest=False):
     """
+    Lazily yields the paths of files with the given extensions (case-insensitive)
+    in root_path (and its subdirectories if recurse = True).
+    PARAMS:
+        - file_types [iterable]: OPTIONAL: file extensions without the dot (None / empty = all files)
+        - manifest [bool]: list files via the cached directory manifest (see manifest.scan_manifest())
     """
-    for d, dirs, files in os.walk(os.path.abspath(root_path)):
-        for f in files:
-            ext = os.path.splitext(f)[1][1:].lower()
-            if (not file_types) or (ext in file_types):
-                if file_process_function:
-                    if not file_process_function(os.path.join(d, f)): return
-        if not recurse: break
+    if isinstance(file_types, str): file_types = (file_types,)
+    if manifest:
+        for path, *_ in scan_manifest(root_path, recurse, file_types):
+            yield path
+        return
+    exts = None if not file_types else tuple('.' + ext.lower() for ext in file_types)
+    stack = [os.path.abspath(root_path)]
+    while stack:
+        subdirs = []
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_file():
+                    if exts is None or entry.name.lower().endswith(exts): yield entry.path
+                elif recurse and entry.is_dir():
+                    subdirs.append(entry.path)
+        stack.extend(reversed(subdirs))
+
+def walk_dir(root_path, recurse, file_types, file_process_function, manifest=False):
+    """
+    Calls file_process_function(path) for each file found by iter_files() until it returns a falsy value.
+    """
+    for path in iter_files(root_path, recurse, file_types, manifest):
+        if file_process_function:
+            if not file_process_function(path): return
     
-def convert_img(img_source, dest_dir=None, dest_format='jpg'):
+def _save_converted(img, img_dest, dest_format):
+    if dest_format == 'jpg':
+        img.convert('RGB').save(img_dest)
+    else:
+        img.save(img_dest)
+
+def convert_img(img_source, dest_dir=None, dest_format='jpg', verbose=True):
     """
     Converts an image file passed in img_source to a given format passed in dest_format,
     saving the result image in dest_dir (if it's set, otherwise - to the source directory).
@@ -53,16 +110,67 @@ def convert_img(img_source, dest_dir=None, dest_format='jpg'):
     img_base = os.path.splitext(img_path[1])
     img_dest = os.path.join(dest_dir if not dest_dir is None else img_path[0], '{}.{}'.format(img_base[0], dest_format))
     if img_source == img_dest: return img_dest
-    print('Converting {}{}...'.format(*img_base), end='\t\t')
+    if verbose: print('Converting {}{}...'.format(*img_base), end='\t\t')
+    from PIL import Image
     try:
-        if dest_format == 'jpg':
-            Image.open(img_source).convert('RGB').save(img_dest)
-        else:
-            Image.open(img_source).save(img_dest)
-        print('DONE')
+        with Image.open(img_source) as img:
+            _save_converted(img, img_dest, dest_format)
+        if verbose: print('DONE')
         return img_dest
     except:
+        if verbose: print('FAILED')
+        return ''
+
+def convert_bytes(data, img_dest, dest_format='jpg'):
+    """
+    Decodes an image from memory (e.g. a downloaded file's content) and saves it 
+    to img_dest in the given format, without writing the original file.
+    RETURNS:
+        img_dest or empty string on error
+    """
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            _save_converted(img, img_dest, dest_format)
+        return img_dest
+    except Exception as err:
+        print_err(str(err))
         return ''
 
-def convert_images(dir_source, recurse=False, dir_dest=None, imgtypes=('gif',), dest_format='jpg'):
-    walk_dir(dir_source, recurse, imgtypes, lambda filein: convert_img(filein, dir_dest, dest_format))
\ No newline at end of file
+def _convert_task(filein, dest_dir, dest_format):
+    return filein, convert_img(filein, dest_dir, dest_format, verbose=False)
+
+def convert_images(dir_source, recurse=False, dir_dest=None, imgtypes=('gif',), dest_format='jpg', workers=1, backend='process', manifest=False):
+    """
+    Converts all images of the given types in a directory (see convert_img()).
+    PARAMS:
+        - dir_dest [str]: OPTIONAL: output directory (created if missing; default = next to the source files)
+        - workers [int]: number of worker processes (1 = convert sequentially, None = all cores)
+        - backend [str]: executor backend used when workers != 1 ('process' or 'dask')
+        - manifest [bool]: list the source directory via its cached manifest (see iter_files())
+    RETURNS:
+        list of converted file paths (files that can't be converted are reported and skipped)
+    """
+    if not dir_dest is None: os.makedirs(dir_dest, exist_ok=True)
+    results = []
+
+    def collect(filein, fileout):
+        # failed files are skipped and reported
+        if fileout:
+            results.append(fileout)
+        else:
+            print_err('Cannot convert {}'.format(filein))
+
+    if workers == 1:
+        for i, filein in enumerate(iter_files(dir_source, recurse, imgtypes, manifest), 1):
+            collect(filein, convert_img(filein, dir_dest, dest_format))
+            report_progress(i)
+        return results
+    files = list(iter_files(dir_source, recurse, imgtypes, manifest))
+    with get_executor(backend, workers) as executor:
+        converted = executor.map(partial(_convert_task, dest_dir=dir_dest, dest_format=dest_format), 
+                                 files, auto_chunksize(len(files), executor.workers))
+        for i, (filein, fileout) in enumerate(converted, 1):
+            collect(filein, fileout)
+            report_progress(i, len(files))
+        return results
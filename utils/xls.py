@@ -5,32 +5,162 @@
 This file is part of the ycaptcha project hosted at https://github.com/S0mbre/ycaptcha
 """
 
+import io
+import itertools
 import xlsxwriter
+from PIL import Image
 from .utils import *
 
+XLS_MAX_ROWS = 1048576          # Excel worksheet row limit
+XLS_ROW_HEIGHT = 50             # row height (points) for full-size images
+XLS_BLOCK_SIZE = 256            # images per block of thumbnails generated in parallel
 
-def images_to_excel(imgdir, xlsfile, nfiles=-1, imgtypes=('jpg', 'png'), recurse=False, scale=1.0):
+def make_thumbnail(imgfile, scale=0.5):
+    """
+    Downscales an image file and encodes it as PNG in memory.
+    RETURNS:
+        tuple (PNG bytes, (width, height)) or (None, None) on error
+    """
+    try:
+        with Image.open(imgfile) as img:
+            img = img.convert('RGBA') if img.mode in ('P', 'LA', 'RGBA') else img.convert('RGB')
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            thumb = img.resize(size, Image.LANCZOS)
+            buf = io.BytesIO()
+            thumb.save(buf, 'PNG', optimize=True)
+            return buf.getvalue(), size
+    except Exception as err:
+        print_err(str(err))
+        return None, None
+
+def _indexed_thumbnail(item, scale):
+    i, imgfile = item
+    return (i,) + make_thumbnail(imgfile, scale)
+
+def _split_filename(xlsfile, part):
+    if part == 0: return xlsfile
+    base, ext = os.path.splitext(xlsfile)
+    return '{}_{:03d}{}'.format(base, part + 1, ext or '.xlsx')
+
+class ExcelImageWriter:
+    """
+    Writes image paths (column A) and the images themselves (column B) into Excel workbook(s) row by row,
+    starting a new workbook / worksheet every split_rows images.
+    Use like so:
+        with ExcelImageWriter('table.xlsx') as writer:
+            writer.write('1.jpg')
+        books = writer.books
+    """
+
+    def __init__(self, xlsfile, split_rows=None, split_mode='book', constant_memory=True, scale=1.0):
+        """
+        PARAMS: see images_to_excel()
+        """
+        if not split_mode in ('book', 'sheet'):
+            raise Exception('split_mode must be "book" or "sheet"')
+        self.xlsfile = xlsfile
+        self.split_rows = min(split_rows or XLS_MAX_ROWS, XLS_MAX_ROWS)
+        self.split_mode = split_mode
+        self.constant_memory = constant_memory
+        self.scale = scale
+        self.books = []
+        self.written = 0
+        self.wb = self.ws = None
+        self.row = 0
+
+    def new_sheet(self):
+        if self.wb is None or self.split_mode == 'book':
+            if not self.wb is None: self.wb.close()
+            self.books.append(_split_filename(self.xlsfile, len(self.books)))
+            self.wb = xlsxwriter.Workbook(self.books[-1], {'constant_memory': self.constant_memory})
+        self.ws = self.wb.add_worksheet()
+        self.ws.set_column('A:A', 80)
+        self.ws.set_column('B:B', 30)
+        self.row = 0
+
+    def write(self, imgfile, thumb=None, size=None):
+        """
+        Writes one row.
+        PARAMS:
+            - imgfile [str]: image path
+            - thumb [bytes]: OPTIONAL: PNG thumbnail to embed instead of the file (see make_thumbnail())
+            - size [tuple]: thumbnail (width, height)
+        """
+        if self.ws is None or self.row >= self.split_rows: self.new_sheet()
+        ws, row = self.ws, self.row
+        if thumb is None:
+            ws.set_row(row, XLS_ROW_HEIGHT)
+            ws.write(row, 0, imgfile)
+            ws.insert_image(row, 1, imgfile, None if self.scale == 1.0 else {'x_scale': self.scale, 'y_scale': self.scale})
+        else:
+            # pixels -> points + margin
+            ws.set_row(row, max(15, size[1] * 0.75 + 2))
+            ws.write(row, 0, imgfile)
+            ws.insert_image(row, 1, imgfile, {'image_data': io.BytesIO(thumb)})
+        self.row += 1
+        self.written += 1
+
+    def close(self):
+        """
+        RETURNS:
+            list of written workbook paths
+        """
+        if self.ws is None: self.new_sheet()
+        self.wb.close()
+        return self.books
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def images_to_excel(imgdir, xlsfile, nfiles=-1, imgtypes=('jpg', 'png'), recurse=False, scale=1.0,
+                    constant_memory=True, split_rows=None, split_mode='book', thumbnails=None, workers=1, backend='process', manifest=False):
     """
     https://xlsxwriter.readthedocs.io/example_images.html
+    Writes image paths (column A) and the images themselves (column B) into Excel workbook(s).
+    PARAMS:
+        - imgdir [str]: image directory
+        - xlsfile [str]: output workbook path; when split into several workbooks,
+          the next ones are named like 'table_002.xlsx', 'table_003.xlsx', ...
+        - nfiles [int]: max number of images to export (-1 = all)
+        - imgtypes [tuple]: image file extensions
+        - recurse [bool]: process subdirectories too
+        - scale [float]: display scale of embedded full-size images
+        - constant_memory [bool]: flush rows to disk as they are written (xlsxwriter 'constant_memory' mode)
+        - split_rows [int]: OPTIONAL: max images per workbook / worksheet (None = Excel's row limit)
+        - split_mode [str]: 'book' = start a new workbook, 'sheet' = start a new worksheet every split_rows images
+        - thumbnails [float]: OPTIONAL: embed PNG thumbnails downscaled by this factor instead of the original files
+          (thumbnails are held in memory until their workbook is closed: use split_rows with split_mode = 'book' to bound memory)
+        - workers [int]: number of processes generating thumbnails (1 = sequential, None = all cores)
+        - backend [str]: executor backend used when workers != 1 ('process' or 'dask')
+        - manifest [bool]: list imgdir via its cached manifest (see utils.iter_files())
+    RETURNS:
+        list of written workbook paths
     """
-        
-    wb = xlsxwriter.Workbook(xlsfile)
-    ws = wb.add_worksheet()
-    ws.set_column('A:A', 80)
-    ws.set_column('B:B', 30)
-    row = 1
-    
-    def write_img(imgfile):
-        nonlocal ws
-        nonlocal row
-        ws.set_row(row - 1, 50)
-        ws.write('A{}'.format(row), imgfile)
-        ws.insert_image('B{}'.format(row), imgfile, None if scale == 1.0 else {'x_scale': scale, 'y_scale': scale})
-        row += 1
-        return nfiles == -1 or row < nfiles
-    
-    walk_dir(imgdir, recurse, imgtypes, write_img)
-    
-    wb.close()
-            
-    
+    writer = ExcelImageWriter(xlsfile, split_rows, split_mode, constant_memory, scale)
+    files = iter_files(imgdir, recurse, imgtypes, manifest)
+    files = list(files if nfiles == -1 else itertools.islice(files, max(0, nfiles)))
+
+    def write_img(imgfile, thumb=None, size=None):
+        writer.write(imgfile, thumb, size)
+        report_progress(writer.written, len(files))
+
+    # the workbook is closed (and the rows written so far saved) even on errors or cancellation
+    with writer:
+        if not thumbnails:
+            for imgfile in files: write_img(imgfile)
+        else:
+            # thumbnails are generated in blocks, so that no more than one block of them waits to be written;
+            # the written ones stay in memory until their workbook is closed (see split_rows);
+            # the executor returns them in any order, but rows must be written in order
+            with get_executor('serial' if workers == 1 else backend, workers) as executor:
+                for start in range(0, len(files), XLS_BLOCK_SIZE):
+                    block = list(enumerate(files[start:start + XLS_BLOCK_SIZE]))
+                    results = sorted(executor.map(partial(_indexed_thumbnail, scale=thumbnails), block,
+                                                  auto_chunksize(len(block), executor.workers)), key=lambda x: x[0])
+                    for i, thumb, size in results:
+                        write_img(block[i][1], thumb, size)
+
+    return writer.books
@@ -11,8 +11,8 @@ Use like so:
 """
 
 from utils.clibase import *
-from utils.download import download_sample_captchas
-from utils.xls import images_to_excel
+# command dependencies (requests, xlsxwriter, PIL, numpy, etc.) are imported in the commands themselves,
+# so that the CLI starts fast and each command loads only what it needs
 
 ## ******************************************************************************** ## 
                 
@@ -41,7 +41,7 @@ class CLI(CLIBase):
            
     #----- COMMAND METHODS ------#    
     
-    def cmd_download(self, user, apikey, domain='com', ncap=1, imgdir=None, saveas='jpg'):
+    def cmd_download(self, user, apikey, domain='com', ncap=1, imgdir=None, saveas='jpg', sharddir=None, concurrency=1, resume=False):
         """
         Downloads requested number of Yandex captchas as [GIF] images to indicated directory.
         PARAMS:
@@ -52,34 +52,252 @@ class CLI(CLIBase):
             - directory [str]: OPTIONAL: the save directory; if None, the current dir's "imgset" folder will be used
             - saveas [str]: OPTIONAL: convert downloaded (GIF) to another image format (default = JPG);
                             Empty string = don't convert
+            - sharddir [str]: OPTIONAL: pack images into dataset shards in this directory instead of separate files
+            - concurrency [int]: OPTIONAL: number of parallel downloads (default = 1)
+            - resume [bool]: OPTIONAL: treat ncap as the total wanted and only download the missing ones
         RETURNS:
             Status text.
         """
+        from utils.download import download_sample_captchas
+        from utils.dlindex import DownloadIndex
         
         def download_callback(i, fpath):
             print(COLOR_BRIGHT + '{}:\t>> {}...'.format((i+1), fpath))
-            new_path = fpath 
-            if saveas: 
-                new_path = convert_img(fpath, dest_format=saveas)
-                if new_path: os.remove(fpath)
-            return new_path        
+            return fpath        
 
-        images = download_sample_captchas(user, apikey, domain, ncap, imgdir, download_callback)
-        return 'Saved {} files to {}'.format(len(images), imgdir if not imgdir is None else IMG_DIRECTORY)
+        images = download_sample_captchas(user, apikey, domain, ncap, imgdir, download_callback, sharddir, concurrency, 
+                                          resume=resume, saveas=saveas)
+        savedir = sharddir or (imgdir if not imgdir is None else IMG_DIRECTORY)
+        with DownloadIndex(savedir) as index:
+            stats = index.stats()
+        return 'Saved {} files to {} ({} in download index)'.format(len(images), savedir, stats['total'])
     
-    def cmd_xls(self, xlsfile=None, imgdir=None, nfiles=-1):
+    def cmd_pipeline(self, user, apikey, domain='com', ncap=1, imgdir=None, xlsfile=None, saveas='jpg', fetchers=8, converters=2, 
+                     queuesize=None, splitrows=None):
+        """
+        Downloads captchas, converts them and exports them to Excel in one pass, with the stages running concurrently
+        (network downloads overlap with decoding and writing; memory use stays flat).
+        Prints per-stage throughput to show the bottleneck.
+        PARAMS:
+            - user [str]: Yandex XML username
+            - apikey [str]: Yandex XML API key
+            - domain [str]: OPTIONAL: either 'ru' (Russian Yandex) or 'com' (worldwide Yandex)
+            - ncap [int]: OPTIONAL: how many captchas to retrieve (default = 1)
+            - imgdir [str]: OPTIONAL: the save directory (default = IMG_DIRECTORY)
+            - xlsfile [str]: OPTIONAL: output workbook (default = 'table.xlsx' in the image directory); 
+                             empty string = don't export
+            - saveas [str]: OPTIONAL: image format (default = JPG); empty string = save as downloaded
+            - fetchers [int]: OPTIONAL: number of parallel downloads (default = 8)
+            - converters [int]: OPTIONAL: number of converting threads (default = 2)
+            - queuesize [int]: OPTIONAL: max images waiting between stages (default = 16)
+            - splitrows [int]: OPTIONAL: start a new workbook every N images
+        RETURNS:
+            Status text.
+        """
+        from utils.pipeline import download_pipeline, format_stats, PIPE_QUEUE_SIZE
+        stats = []
+        files, books = download_pipeline(user, apikey, domain, ncap, imgdir, xlsfile, saveas, fetchers, converters, 
+                                         queuesize or PIPE_QUEUE_SIZE, splitrows, stats=stats)
+        print(format_stats(stats))
+        return 'Saved {} files, exported to: {}'.format(len(files), ', '.join(books) or '-')
+    
+    def cmd_bench(self, names=None, n=200, seed=0, output=None, baseline=None, tolerance=0.1):
+        """
+        Runs performance benchmarks of the synthesis, download and export hot paths.
+        PARAMS:
+            - names [str]: OPTIONAL: comma-separated benchmark names: 
+                           synth, npsynth, bezier, transform, convert, excel, download, pipeline (default = all)
+            - n [int]: OPTIONAL: number of items per benchmark (default = 200)
+            - seed [int]: OPTIONAL: random seed (default = 0)
+            - output [str]: OPTIONAL: JSON file to save the results to
+            - baseline [str]: OPTIONAL: JSON file with saved results to compare with
+            - tolerance [float]: OPTIONAL: allowed slowdown against the baseline (default = 0.1 = 10%)
+        RETURNS:
+            Status text.
+        """
+        from benchmarks.suite import run_benchmarks
+        if isinstance(names, (tuple, list)): names = ','.join(names)
+        results, regressions = run_benchmarks(names, n, seed, output, baseline, tolerance)
+        for name, base, cur in regressions:
+            print_err('REGRESSION: {}: {:.1f}/s (baseline {:.1f}/s)'.format(name, cur, base))
+        return 'Ran {} benchmarks, {} regressions'.format(len(results), len(regressions))
+    
+    def cmd_importtime(self, module='ycap', top=15, runs=3):
+        """
+        Reports how long it takes to import the CLI (or another module) in a fresh interpreter
+        and which imports are the slowest (as 'python -X importtime').
+        PARAMS:
+            - module [str]: OPTIONAL: module to import (default = ycap)
+            - top [int]: OPTIONAL: number of slowest imports to list (default = 15)
+            - runs [int]: OPTIONAL: number of timed imports (default = 3)
+        RETURNS:
+            Status text.
+        """
+        from benchmarks.importtime import importtime_report, format_report, bench_import
+        print(format_report(importtime_report(module), top))
+        res = bench_import(module, runs)
+        return 'import {module}: median = {import_median:.3f}s; process: median = {process_median:.3f}s'.format(**res)
+    
+    def cmd_convert(self, imgdir=None, saveas='jpg', imgtypes='gif', recurse=False, destdir=None, workers=None, manifest=False):
+        """
+        Converts images in a directory to another format.
+        PARAMS:
+            - imgdir [str]: OPTIONAL: the source directory (default = IMG_DIRECTORY)
+            - saveas [str]: OPTIONAL: target image format (default = JPG)
+            - imgtypes [str]: OPTIONAL: comma-separated source image types (default = GIF)
+            - recurse [bool]: OPTIONAL: process subdirectories too
+            - destdir [str]: OPTIONAL: the save directory (created if missing; default = same as source)
+            - workers [int]: OPTIONAL: number of worker processes (default = all cores; 1 = sequential)
+            - manifest [bool]: OPTIONAL: list files via the cached directory manifest (faster repeat scans)
+        RETURNS:
+            Status text.
+        """
+        img_dir = imgdir if not imgdir is None else IMG_DIRECTORY
+        imgtypes = tuple(imgtypes.split(',')) if isinstance(imgtypes, str) else tuple(imgtypes)
+        converted = convert_images(img_dir, recurse, destdir, imgtypes, saveas, workers, manifest=manifest)
+        return 'Converted {} files'.format(len(converted))
+    
+    def cmd_xls(self, xlsfile=None, imgdir=None, nfiles=-1, splitrows=None, splitmode='book', thumbnails=None, workers=1, manifest=False):
         """
         Copies saved images to Excel spreadsheet (for storing captcha values).
+        PARAMS:
+            - xlsfile [str]: OPTIONAL: output workbook (default = 'table.xlsx' in the image directory)
+            - imgdir [str]: OPTIONAL: image directory
+            - nfiles [int]: OPTIONAL: max number of images (default = -1 = all)
+            - splitrows [int]: OPTIONAL: start a new workbook / worksheet every N images
+            - splitmode [str]: OPTIONAL: 'book' (default) or 'sheet'
+            - thumbnails [float]: OPTIONAL: embed thumbnails downscaled by this factor (e.g. 0.5)
+            - workers [int]: OPTIONAL: number of processes making thumbnails (default = 1; None = all cores)
+            - manifest [bool]: OPTIONAL: list files via the cached directory manifest (faster repeat scans)
+        RETURNS:
+            Status text.
         """
+        from utils.xls import images_to_excel
         img_dir = imgdir if not imgdir is None else IMG_DIRECTORY
         #convert_images(img_dir)
-        images_to_excel(img_dir, xlsfile if not xlsfile is None else IMG_DIRECTORY + '/table.xlsx', nfiles, scale=1.0)
+        books = images_to_excel(img_dir, xlsfile if not xlsfile is None else IMG_DIRECTORY + '/table.xlsx', nfiles, scale=1.0,
+                                split_rows=splitrows, split_mode=splitmode, thumbnails=thumbnails, workers=workers, manifest=manifest)
+        return 'Saved {} workbook(s): {}'.format(len(books), ', '.join(books))
+                
+            
+    def cmd_labels(self, xlsfile=None, imgdir=None, storedir=None):
+        """
+        Imports captcha values typed into the Excel spreadsheet (column C) made by the 'x' command
+        into the label store (labels.sqlite) keyed by image file hash.
+        PARAMS:
+            - xlsfile [str]: OPTIONAL: the spreadsheet (default = 'table.xlsx' in the image directory);
+                             its split parts ('table_002.xlsx', ...) are imported too
+            - imgdir [str]: OPTIONAL: image directory (to find images moved after the export)
+            - storedir [str]: OPTIONAL: label store directory (default = image directory)
+        RETURNS:
+            Status text.
+        """
+        from imgprocess.capprocess import YC_CHARS, YC_LENGTH
+        from utils.labels import import_labels, LabelStore
+        img_dir = imgdir if not imgdir is None else IMG_DIRECTORY
+        store_dir = storedir if not storedir is None else img_dir
+        stats = import_labels(xlsfile if not xlsfile is None else IMG_DIRECTORY + '/table.xlsx', store_dir, 
+                              YC_CHARS, YC_LENGTH, img_dir)
+        for xlsfile, sheet, row, value in stats['invalid']:
+            print_err('{} [{}] row {}: invalid label "{}"'.format(xlsfile, sheet, row, value))
+        for xlsfile, sheet, row, path in stats['missing']:
+            print_err('{} [{}] row {}: image not found "{}"'.format(xlsfile, sheet, row, path))
+        with LabelStore(store_dir) as store:
+            total = len(store)
+        return 'Imported {} labels ({} invalid, {} missing images, {} empty rows), {} in label store'.format(
+            stats['imported'], len(stats['invalid']), len(stats['missing']), stats['empty'], total)
+                
+            
+    def cmd_normalize(self, imgdir=None, sharddir=None, mode='binary', threshold=None, logo=True, recurse=False, 
+                      full=False, labeldir=None, workers=None):
+        """
+        Preprocesses downloaded captchas into a sharded dataset of model-ready grayscale arrays
+        (same size as synthetic captchas).
+        PARAMS:
+            - imgdir [str]: OPTIONAL: image directory (default = IMG_DIRECTORY)
+            - sharddir [str]: OPTIONAL: dataset directory (default = 'prep' in the image directory)
+            - mode [str]: OPTIONAL: 'binary' (default), 'normalize' or 'gray'
+            - threshold [int]: OPTIONAL: binarization threshold (default = automatic per image)
+            - logo [bool]: OPTIONAL: mask out the Yandex logo (default = True)
+            - recurse [bool]: OPTIONAL: process subdirectories too
+            - full [bool]: OPTIONAL: reprocess all files (default = only files added since the last run)
+            - labeldir [str]: OPTIONAL: label store directory (default = image directory, see 'l' command)
+            - workers [int]: OPTIONAL: number of worker processes (default = all cores)
+        RETURNS:
+            Status text.
+        """
+        from imgprocess.preprocess import preprocess_captchas
+        img_dir = imgdir if not imgdir is None else IMG_DIRECTORY
+        shard_dir = sharddir if not sharddir is None else os.path.join(img_dir, 'prep')
+        added = preprocess_captchas(img_dir, shard_dir, mode, threshold, logo, recurse=recurse, incremental=not full,
+                                    label_dir=labeldir if not labeldir is None else img_dir, workers=workers)
+        return 'Added {} images to {}'.format(added, shard_dir)
+
+    def cmd_generate(self, count=1000, sharddir=None, difficulty='normal', seed=None, workers=None, backend='process'):
+        """
+        Generates synthetic captchas (PNG files in the save folder or a sharded dataset).
+        Worker processes are kept warm between commands, so repeated runs start instantly.
+        PARAMS:
+            - count [int]: OPTIONAL: number of captchas (default = 1000)
+            - sharddir [str]: OPTIONAL: dataset directory (default = save PNG files)
+            - difficulty [str|float]: OPTIONAL: 'easy', 'normal' (default), 'hard' or a scale factor
+            - seed [int]: OPTIONAL: dataset seed (default = not reproducible)
+            - workers [int]: OPTIONAL: number of worker processes (default = all cores)
+            - backend [str]: OPTIONAL: 'process' (default), 'dask' or 'serial'
+        RETURNS:
+            Status text.
+        """
+        from imgprocess.capprocess import generate_captchas, synth_config
+        t = time.perf_counter()
+        res = generate_captchas(count, backend, workers, shard_dir=sharddir, seed=seed, config=synth_config(difficulty))
+        return 'Generated {} captchas in {:.2f} sec.'.format(len(res), time.perf_counter() - t)
+
+            
+    def cmd_solve(self, images=None, imgdir=None, model=None, serve=False, port=None, maxbatch=None, maxwait=None, mode='gray'):
+        """
+        Solves captchas with the trained model (CPU only) or runs a local solving service.
+        PARAMS:
+            - images [str]: OPTIONAL: comma-separated image files to solve
+            - imgdir [str]: OPTIONAL: solve all images in this directory (if images aren't given)
+            - model [str]: OPTIONAL: model file (default = models/ycaptcha.h5)
+            - serve [bool]: OPTIONAL: run the HTTP service (POST /solve, GET /stats) until Ctrl+C
+            - port [int]: OPTIONAL: service port (default = 8765)
+            - maxbatch [int]: OPTIONAL: max images per model call (default = 64)
+            - maxwait [float]: OPTIONAL: max time (sec.) to wait for a batch to fill (default = 0.005)
+            - mode [str]: OPTIONAL: input preprocessing: 'gray' (default), 'binary' or 'normalize'
+        RETURNS:
+            Status text.
+        """
+        from imgprocess import solver as slv
+        solver = slv.Solver(model or slv.MODEL_FILE, mode)
+        maxbatch = maxbatch or slv.SOLVER_MAX_BATCH
+        maxwait = slv.SOLVER_MAX_WAIT if maxwait is None else maxwait
+        if serve:
+            with slv.SolverServer(solver, port=port or slv.SOLVER_PORT, max_batch=maxbatch, max_wait=maxwait) as server:
+                print_dbg('Solving service running at {} (Ctrl+C to stop)'.format(server.url))
+                try:
+                    while True: time.sleep(1)
+                except KeyboardInterrupt:
+                    pass
+                stats = server.batcher.stats()
+            return 'Solved {} captchas in {} batches ({:.1f}/s)'.format(stats['requests'], stats['batches'], stats['per_sec'])
+        if images:
+            files = [f.strip() for f in images.split(',')] if isinstance(images, str) else list(images)
+        else:
+            files = list(iter_files(imgdir if not imgdir is None else IMG_DIRECTORY, False, ('gif', 'jpg', 'jpeg', 'png')))
+        t = time.perf_counter()
+        for i in range(0, len(files), maxbatch):
+            labels, confidence = solver.solve(files[i:i + maxbatch])
+            for f, label, conf in zip(files[i:i + maxbatch], labels, confidence):
+                print('{}\t{}\t{:.3f}'.format(f, label, conf))
+        elapsed = time.perf_counter() - t
+        return 'Solved {} captchas in {:.2f} sec. ({:.1f}/s)'.format(len(files), elapsed, len(files) / elapsed if elapsed else 0.0)
                 
             
 ## ******************************************************************************** ##             
     
 def main():    
-    fire.Fire(CLI, 'run')
+    CLI().run()
 
 ## ******************************************************************************** ##    
        